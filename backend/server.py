@@ -1,164 +1,3526 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Awaitable, Iterator, Union
 import os
-import requests
 import json
 import uuid
 from datetime import datetime
 import aiofiles
 import aiohttp
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne, ReplaceOne, DeleteMany, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
+from bson import ObjectId, encode as bson_encode
 import asyncio
+import base64
 import hashlib
+import shutil
+import mimetypes
 from urllib.parse import urljoin, urlparse
+import io
+import random
 import re
+import socket
+import unicodedata
+import sys
+import struct
+import zipfile
+import zlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401  registers AVIF support on older Pillow releases
+    except ImportError:
+        pass
+    Image.init()
+except ImportError:
+    Image = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsRegistry:
+    """Minimal Prometheus-style counters, gauges and histograms
+
+    Observations can come from driver threads (the Mongo command listener), so
+    updates take a lock; they are a few dictionary operations each.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta: Dict[str, tuple] = {}
+        self.counters: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, List] = {}
+        self.gauges: Dict[str, Callable[[], Dict[tuple, float]]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self.meta[name] = (kind, help_text)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1.0):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def observe(self, name: str, labels: tuple, value: float, buckets: tuple = LATENCY_BUCKETS):
+        with self.lock:
+            series = self.histograms.get((name, labels))
+            if series is None:
+                series = self.histograms[(name, labels)] = [[0] * len(buckets), 0.0, 0, buckets]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Dict[tuple, float]]):
+        self.describe(name, "gauge", help_text)
+        self.gauges[name] = collect
+
+    @staticmethod
+    def format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: [list(v[0]), v[1], v[2], v[3]] for key, v in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text) in sorted(self.meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (series, labels), value in counters.items():
+                    if series == name:
+                        lines.append(f"{name}{self.format_labels(labels)} {value}")
+            elif kind == "histogram":
+                for (series, labels), (buckets, total, count, bounds) in histograms.items():
+                    if series != name:
+                        continue
+                    cumulative = 0
+                    for bound, hits in zip(bounds, buckets):
+                        cumulative += hits
+                        lines.append(f"{name}_bucket{self.format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+            elif kind == "gauge":
+                try:
+                    values = self.gauges[name]()
+                except Exception:
+                    values = {}
+                for labels, value in values.items():
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("http_requests_total", "counter", "HTTP requests by route, method and status")
+metrics.describe("http_request_duration_seconds", "histogram", "HTTP request latency by route and method")
+metrics.describe("mongo_command_duration_seconds", "histogram", "MongoDB command latency by collection and operation")
+metrics.describe("mongo_command_failures_total", "counter", "Failed MongoDB commands by collection and operation")
+metrics.describe("outbound_request_duration_seconds", "histogram", "Outbound fetch latency by source and kind")
+metrics.describe("outbound_request_failures_total", "counter", "Failed outbound fetches by source and kind")
+metrics.describe("download_pages_total", "counter", "Pages downloaded to disk")
+metrics.describe("download_bytes_total", "counter", "Bytes downloaded to disk")
+metrics.describe("event_loop_lag_seconds", "histogram", "Delay of the event loop waking up a timer")
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command, labelled by collection and operation"""
+
+    def __init__(self):
+        self.pending: Dict[tuple, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self.pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        metrics.observe("mongo_command_duration_seconds",
+                        (("collection", collection), ("operation", event.command_name)),
+                        event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        labels = (("collection", collection), ("operation", event.command_name))
+        metrics.observe("mongo_command_duration_seconds", labels, event.duration_micros / 1e6)
+        metrics.inc("mongo_command_failures_total", labels)
+
+def observe_outbound(source: str, kind: str, started: float, failed: bool = False):
+    """Record one outbound fetch that began at time.monotonic() == started"""
+    labels = (("source", source), ("kind", kind))
+    metrics.observe("outbound_request_duration_seconds", labels, time.monotonic() - started)
+    if failed:
+        metrics.inc("outbound_request_failures_total", labels)
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.monotonic()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope.get("method", "")
+            metrics.inc("http_requests_total", (("route", path), ("method", method), ("status", status["code"])))
+            metrics.observe("http_request_duration_seconds", (("route", path), ("method", method)),
+                            time.monotonic() - started)
+
+async def event_loop_lag_monitor(interval: float = 0.5):
+    """Measure how late the event loop wakes up from a sleep"""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        metrics.observe("event_loop_lag_seconds", (), max(time.monotonic() - started - interval, 0.0))
+
+# JSON serialization
+NDJSON_BATCH_SIZE = int(os.environ.get('NDJSON_BATCH_SIZE', '500'))  # documents per cursor batch and write
+
+def json_default(value: Any) -> Any:
+    """Encode the Mongo and Pydantic types that show up in responses"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+def dumps_json(content: Any) -> bytes:
+    """Serialize straight to UTF-8 bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=json_default, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by dumps_json; return it directly to skip jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+async def iter_ndjson(cursor, prefix: Optional[Dict[str, Any]] = None, suffix: Optional[Dict[str, Any]] = None,
+                      transform: Optional[Callable[[Dict], Dict]] = None):
+    """Stream a motor cursor as NDJSON, one write per cursor batch"""
+    if prefix is not None:
+        yield dumps_json(prefix) + b"\n"
+    lines = []
+    async for doc in cursor.batch_size(NDJSON_BATCH_SIZE):
+        lines.append(dumps_json(transform(doc) if transform else doc))
+        if len(lines) >= NDJSON_BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+    if suffix is not None:
+        yield dumps_json(suffix) + b"\n"
+
+def ndjson_response(cursor, prefix: Optional[Dict[str, Any]] = None, suffix: Optional[Dict[str, Any]] = None,
+                    transform: Optional[Callable[[Dict], Dict]] = None) -> StreamingResponse:
+    return StreamingResponse(iter_ndjson(cursor, prefix, suffix, transform), media_type="application/x-ndjson")
 
 # MongoDB setup
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.manga_slayer
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoCommandMetrics()])
+db = client[os.environ.get('MONGO_DB', 'manga_slayer')]
+
+logger = logging.getLogger("manga_slayer")
+
+app = FastAPI(title="Manga Slayer API", version="1.0.0", default_response_class=FastJSONResponse)
+
+# CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MetricsMiddleware)
+
+# Create downloads directory
+DOWNLOADS_DIR = os.environ.get('DOWNLOADS_DIR', '/app/downloads')
+os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+# Translation batching and memoization
+TRANSLATION_BATCH_SIZE = int(os.environ.get('TRANSLATION_BATCH_SIZE', '100'))
+TRANSLATION_BATCH_WINDOW = float(os.environ.get('TRANSLATION_BATCH_WINDOW', '0.05'))  # seconds
+TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', '10000'))
+TRANSLATION_JOB_CHUNK = 500  # chapters per bulk_write in a manga translation job
+TRANSLATION_JOB_HISTORY = 256  # finished translation jobs kept for polling
+
+# Reading progress write buffer
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', '0.5'))  # seconds
+PROGRESS_FLUSH_MAX = int(os.environ.get('PROGRESS_FLUSH_MAX', '500'))  # entries that force an early flush
+
+# Serialized response cache for read-mostly endpoints
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '2048'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 ** 2)))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '60'))  # bounds staleness across workers
+
+# Next-chapter prefetch
+PREFETCH_TRIGGER_PAGES = int(os.environ.get('PREFETCH_TRIGGER_PAGES', '3'))  # pages before chapter end
+PREFETCH_CHAPTERS = int(os.environ.get('PREFETCH_CHAPTERS', '1'))
+PREFETCH_CONCURRENCY = int(os.environ.get('PREFETCH_CONCURRENCY', '2'))  # pages in flight for all prefetches
+CHAPTER_META_CACHE_SIZE = 4096
+
+# Remote page cache
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/app/page_cache')
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+
+# Responsive page variants
+VARIANT_WIDTHS = (360, 480, 720, 1080, 1440)
+VARIANT_FORMATS = {"webp": ("WEBP", "image/webp"), "avif": ("AVIF", "image/avif"), "jpeg": ("JPEG", "image/jpeg")}
+VARIANT_QUALITY = int(os.environ.get('VARIANT_QUALITY', '80'))
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', str(os.cpu_count() or 2)))
+# Variants generated as soon as a chapter finishes downloading, e.g. "720:webp,1080:webp"
+VARIANT_PREGENERATE = [
+    (int(width), fmt) for width, fmt in
+    (item.split(":") for item in os.environ.get('VARIANT_PREGENERATE', '').split(",") if item)
+]
+
+# Chapter storage: "directory" keeps one file per page, "cbz" packs completed chapters
+# into an uncompressed CBZ archive next to the chapter directory
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'directory')
+ARCHIVE_INDEX_CACHE_SIZE = 256
+ARCHIVE_EXPORT_WORKERS = int(os.environ.get('ARCHIVE_EXPORT_WORKERS', '4'))  # ZIP streams written at once; more wait
+CBZ_MEDIA_TYPE = "application/vnd.comicbook+zip"
+
+# Download engine tuning
+DOWNLOAD_MAX_CONCURRENCY = int(os.environ.get('DOWNLOAD_MAX_CONCURRENCY', '16'))  # pages in flight overall
+DOWNLOAD_PER_HOST_CONCURRENCY = int(os.environ.get('DOWNLOAD_PER_HOST_CONCURRENCY', '4'))  # pages in flight per host
+DOWNLOAD_CHAPTER_CONCURRENCY = int(os.environ.get('DOWNLOAD_CHAPTER_CONCURRENCY', '4'))  # chapters in flight per worker process
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_RETRIES = 3
+HTTP_TIMEOUT = int(os.environ.get('HTTP_TIMEOUT', '30'))
+
+# Durable download queue: chapters are leased from db.download_queue by any worker
+DOWNLOAD_WORKER = os.environ.get('DOWNLOAD_WORKER', 'true').lower() in ('1', 'true', 'yes')  # work the queue in this process
+DOWNLOAD_LEASE_SECONDS = int(os.environ.get('DOWNLOAD_LEASE_SECONDS', '60'))
+DOWNLOAD_HEARTBEAT_INTERVAL = float(os.environ.get('DOWNLOAD_HEARTBEAT_INTERVAL', '15'))
+DOWNLOAD_QUEUE_POLL = float(os.environ.get('DOWNLOAD_QUEUE_POLL', '2'))  # seconds between claims when idle
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get('DOWNLOAD_MAX_ATTEMPTS', '5'))
+DOWNLOAD_RETRY_BASE = 5.0  # seconds, doubled per attempt
+DOWNLOAD_RETRY_MAX = 600.0
+DOWNLOAD_PRIORITY_MANGA = 0
+DOWNLOAD_PRIORITY_CHAPTER = 10  # single chapters jump ahead of bulk manga downloads
+DOWNLOAD_JOB_COUNTERS = ("pages_downloaded", "pages_skipped", "bytes_downloaded")
+
+# Search fan-out limits (seconds)
+SEARCH_SOURCE_TIMEOUT = float(os.environ.get('SEARCH_SOURCE_TIMEOUT', '5'))
+SEARCH_DEADLINE = float(os.environ.get('SEARCH_DEADLINE', '8'))
+
+# Source health probing
+SOURCE_PROBE_TIMEOUT = float(os.environ.get('SOURCE_PROBE_TIMEOUT', '5'))
+SOURCE_HEALTH_INTERVAL = int(os.environ.get('SOURCE_HEALTH_INTERVAL', '120'))
+SOURCE_DOWN_THRESHOLD = 3  # consecutive failed probes before search skips a source
+
+# Search result cache: fresh for TTL seconds, then served stale while refreshing
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '1024'))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_STALE_TTL = float(os.environ.get('SEARCH_CACHE_STALE_TTL', '3600'))
+SEARCH_CACHE_MONGO = os.environ.get('SEARCH_CACHE_MONGO', 'false').lower() in ('1', 'true', 'yes')
+
+# Chapter listing pagination
+CHAPTER_PAGE_SIZE = 100
+CHAPTER_PAGE_MAX = 500
+CHAPTER_SUMMARY_WINDOW = 20  # chapters embedded in the manga detail response
+CHAPTER_LIST_PROJECTION = {"_id": 0, "pages": 0}
+MANGA_BATCH_MAX = 500  # ids per batch lookup
+
+# Delta sync for offline clients
+SYNC_PAGE_SIZE = 1000  # documents per /api/sync response
+SYNC_PAGE_MAX = 5000
+SYNC_OVERLAP = float(os.environ.get('SYNC_OVERLAP', '5'))  # seconds re-sent to cover clock skew between workers
+SYNC_TOMBSTONE_TTL = int(os.environ.get('SYNC_TOMBSTONE_TTL', str(30 * 24 * 3600)))  # older tokens get a full resync
+
+# Storage ledger drift correction interval (seconds)
+LEDGER_RECONCILE_INTERVAL = int(os.environ.get('LEDGER_RECONCILE_INTERVAL', '3600'))
+
+# Content-addressed page store: identical pages are hardlinks to one object file
+PAGE_DEDUP = os.environ.get('PAGE_DEDUP', 'true').lower() in ('1', 'true', 'yes')
+PAGE_STORE_DIR = os.path.join(DOWNLOADS_DIR, ".objects")  # must share a filesystem with the chapters
+DEDUP_HASH_WORKERS = int(os.environ.get('DEDUP_HASH_WORKERS', '4'))
+DEDUP_LEDGER_ID = "dedup"
+
+# Storage quota for DOWNLOADS_DIR, enforced by evicting least-recently-read chapters
+DOWNLOAD_QUOTA_BYTES = int(os.environ.get('DOWNLOAD_QUOTA_BYTES', '0'))  # 0 disables the quota
+DOWNLOAD_MIN_FREE_BYTES = int(os.environ.get('DOWNLOAD_MIN_FREE_BYTES', '0'))  # also evict when the disk runs low
+QUOTA_LOW_WATERMARK = float(os.environ.get('QUOTA_LOW_WATERMARK', '0.9'))  # evict down to this share of the quota
+QUOTA_CHECK_INTERVAL = float(os.environ.get('QUOTA_CHECK_INTERVAL', '60'))
+QUOTA_KEEP_AHEAD = int(os.environ.get('QUOTA_KEEP_AHEAD', '3'))  # chapters past a reader's position never evicted
+
+# Local catalog search
+CATALOG_INDEX_REFRESH = int(os.environ.get('CATALOG_INDEX_REFRESH', '900'))  # full rebuild, picks up other workers' writes
+CATALOG_TYPO_LONG_TOKEN = 6  # tokens this long tolerate two typos, shorter ones (3+ letters) one
+CATALOG_SEARCH_LIMIT = 50
+CATALOG_SEARCH_MAX = 200
+CATALOG_FIELD_WEIGHTS = {"title": 3.0, "title_ar": 3.0, "description": 1.0, "description_ar": 1.0}
+CATALOG_SUMMARY_FIELDS = ("id", "title", "title_ar", "cover_image", "source", "download_status")
+
+# Pydantic models
+class MangaSource(BaseModel):
+    id: str
+    name: str
+    url: str
+    type: str = "custom"  # built-in or custom
+    enabled: bool = True
+    added_date: datetime = None
+
+class MangaInfo(BaseModel):
+    id: str
+    title: str
+    title_ar: str = ""
+    description: str = ""
+    description_ar: str = ""
+    cover_image: str = ""
+    source: str
+    chapters: List[Dict] = []
+    total_size: int = 0  # in bytes
+    download_status: str = "not_downloaded"  # not_downloaded, downloading, completed
+    pinned: bool = False  # keeps every downloaded chapter out of quota eviction
+
+class PageRange(BaseModel):
+    """Numbered pages: prefix + zero-padded start..start+count-1 + suffix"""
+    prefix: str
+    start: int
+    count: int
+    width: int = 0
+    suffix: str = ""
+
+class PageSuffixes(BaseModel):
+    """Pages sharing a URL prefix"""
+    prefix: str
+    suffixes: List[str]
+
+class ChapterInfo(BaseModel):
+    id: str
+    manga_id: str
+    chapter_number: float
+    title: str
+    title_ar: str = ""
+    pages: Union[List[str], PageRange, PageSuffixes] = []
+    size: int = 0  # in bytes
+    download_status: str = "not_downloaded"
+    download_path: str = ""
+    pinned: bool = False  # never evicted by the storage quota
+
+class MangaBatchRequest(BaseModel):
+    ids: List[str]
+    user: str = "default"
+
+class DownloadStats(BaseModel):
+    total_manga: int
+    total_chapters: int
+    total_size: int
+    logical_size: int = 0
+    available_space: int
+
+class AutoScrollSettings(BaseModel):
+    speed: int = 3  # 1-10 scale
+    enabled: bool = False
+    pause_on_tap: bool = True
+
+class UserPreferences(BaseModel):
+    auto_scroll: AutoScrollSettings = AutoScrollSettings()
+    language: str = "ar"
+    reading_direction: str = "rtl"
+    auto_translate: bool = True
+
+# Built-in manga sources
+BUILT_IN_SOURCES = [
+    {
+        "id": "mangadex",
+        "name": "MangaDex",
+        "url": "https://api.mangadex.org",
+        "type": "built-in"
+    },
+    {
+        "id": "mangakakalot",
+        "name": "MangaKakalot",
+        "url": "https://mangakakalot.com",
+        "type": "built-in"
+    },
+    {
+        "id": "manganato",
+        "name": "Manganato", 
+        "url": "https://manganato.com",
+        "type": "built-in"
+    }
+]
+
+# Translation service (placeholder for Google Translate API)
+async def translate_texts(texts: List[str], target_lang: str = "ar") -> List[str]:
+    """Translate a batch of texts in one backend call using Google Translate API"""
+    try:
+        # This is a placeholder - in production you'd send the whole batch to Google Translate API
+        # For now, returning the original texts with [AR] prefix
+        return [f"[مترجم] {text}" for text in texts]
+    except Exception as e:
+        return texts
+
+async def translate_text(text: str, target_lang: str = "ar") -> str:
+    """Translate text to Arabic, batched and memoized through the translator"""
+    try:
+        return await translator.translate(text, target_lang)
+    except Exception as e:
+        return text
+
+# Helper functions
+def manga_id_for(source_url: str, slug: str) -> str:
+    """Stable manga ID derived from the source and its own identifier for the series"""
+    key = "\x00".join((source_url.rstrip("/").lower(), slug.strip().lower()))
+    return f"manga_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+async def fetch_manga_from_source(source_url: str, search_query: str = "") -> List[Dict]:
+    """Fetch manga list from a source"""
+    try:
+        # This is a placeholder implementation
+        # In production, you'd implement specific parsers for each source
+        sample_manga = [
+            {
+                "id": manga_id_for(source_url, "one-piece"),
+                "slug": "one-piece",
+                "title": "One Piece",
+                "title_ar": "قطعة واحدة",
+                "cover_image": "https://via.placeholder.com/300x400",
+                "chapters_count": 1000,
+                "source": source_url
+            },
+            {
+                "id": manga_id_for(source_url, "naruto"),
+                "slug": "naruto",
+                "title": "Naruto",
+                "title_ar": "ناروتو",
+                "cover_image": "https://via.placeholder.com/300x400",
+                "chapters_count": 700,
+                "source": source_url
+            }
+        ]
+        return sample_manga
+    except Exception as e:
+        return []
+
+# Translator
+class Translator:
+    """Batches translation requests and memoizes the results
+
+    Strings requested within TRANSLATION_BATCH_WINDOW are sent to the backend
+    together; identical strings in flight share one future. Results are kept in
+    an LRU and in the db.translation_memory collection.
+    """
+
+    def __init__(self, backend, batch_size: int, batch_window: float, cache_size: int):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.pending: Dict[str, Dict[str, str]] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.counters = {"hits": 0, "coalesced": 0, "memory_hits": 0, "backend_strings": 0, "batches": 0}
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    async def translate(self, text: str, target_lang: str) -> str:
+        if not text or not text.strip():
+            return text
+        key = (self.text_key(text), target_lang)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.counters["hits"] += 1
+            return self.cache[key]
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        batch = self.pending.setdefault(target_lang, {})
+        batch[key[0]] = text
+        if len(batch) >= self.batch_size:
+            self.flush(target_lang)
+        elif target_lang not in self.timers:
+            self.timers[target_lang] = asyncio.get_running_loop().call_later(self.batch_window, self.flush, target_lang)
+        return await asyncio.shield(future)
+
+    async def translate_many(self, texts: List[str], target_lang: str) -> List[str]:
+        return await asyncio.gather(*[self.translate(text, target_lang) for text in texts])
+
+    def flush(self, target_lang: str):
+        timer = self.timers.pop(target_lang, None)
+        if timer:
+            timer.cancel()
+        batch = self.pending.pop(target_lang, None)
+        if batch:
+            spawn_background(self.run_batch(target_lang, batch))
+
+    async def run_batch(self, target_lang: str, batch: Dict[str, str]):
+        results: Dict[str, str] = {}
+        try:
+            try:
+                memory = await db.translation_memory.find(
+                    {"_id": {"$in": [f"{target_lang}:{key}" for key in batch]}}
+                ).to_list(length=None)
+                results.update({doc["text_hash"]: doc["translation"] for doc in memory})
+                self.counters["memory_hits"] += len(memory)
+            except Exception:
+                pass
+
+            missing = [key for key in batch if key not in results]
+            if missing:
+                translations = await self.backend([batch[key] for key in missing], target_lang)
+                self.counters["batches"] += 1
+                self.counters["backend_strings"] += len(missing)
+                results.update(zip(missing, translations))
+                try:
+                    await db.translation_memory.bulk_write([
+                        UpdateOne(
+                            {"_id": f"{target_lang}:{key}"},
+                            {"$setOnInsert": {
+                                "text_hash": key, "target_lang": target_lang, "text": batch[key],
+                                "translation": results[key], "created_at": datetime.now(),
+                            }},
+                            upsert=True
+                        )
+                        for key in missing
+                    ], ordered=False)
+                except Exception:
+                    pass
+
+            for key, translation in results.items():
+                self.cache[(key, target_lang)] = translation
+                self.cache.move_to_end((key, target_lang))
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        except Exception as e:
+            for key in batch:
+                future = self.inflight.pop((key, target_lang), None)
+                if future and not future.done():
+                    future.set_exception(e)
+            return
+        for key in batch:
+            future = self.inflight.pop((key, target_lang), None)
+            if future and not future.done():
+                future.set_result(results.get(key, batch[key]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "size": len(self.cache), "max_entries": self.cache_size, "inflight": len(self.inflight)}
+
+translator = Translator(translate_texts, TRANSLATION_BATCH_SIZE, TRANSLATION_BATCH_WINDOW, TRANSLATION_CACHE_SIZE)
+translation_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def remember_translation_job(job: Dict[str, Any]):
+    """Track a job for polling, forgetting the oldest finished ones past TRANSLATION_JOB_HISTORY"""
+    translation_jobs[job["id"]] = job
+    finished = [job_id for job_id, j in translation_jobs.items() if j["status"] in ("completed", "failed")]
+    for job_id in finished[:max(len(translation_jobs) - TRANSLATION_JOB_HISTORY, 0)]:
+        del translation_jobs[job_id]
+
+async def run_manga_translation_job(job: Dict[str, Any], manga_id: str, target_lang: str):
+    """Fill every missing title/description translation of a manga"""
+    title_field, description_field = f"title_{target_lang}", f"description_{target_lang}"
+    job["status"] = "running"
+    job["started_at"] = datetime.now()
+    try:
+        manga = await db.manga.find_one({"id": manga_id}, {"_id": 0, "title": 1, "description": 1,
+                                                           title_field: 1, description_field: 1})
+        manga_update = {}
+        if manga.get("title") and not manga.get(title_field):
+            manga_update[title_field] = await translator.translate(manga["title"], target_lang)
+        if manga.get("description") and not manga.get(description_field):
+            manga_update[description_field] = await translator.translate(manga["description"], target_lang)
+        if manga_update:
+            await db.manga.update_one({"id": manga_id}, touch({"$set": manga_update}))
+            response_cache.invalidate(f"manga:{manga_id}")
+            await reindex_manga(manga_id)
+            job["manga_fields"] = len(manga_update)
+
+        cursor = db.chapters.find(
+            {"manga_id": manga_id, "$or": [{title_field: {"$exists": False}}, {title_field: ""}]},
+            {"_id": 0, "id": 1, "title": 1}
+        ).batch_size(TRANSLATION_JOB_CHUNK)
+        chunk = []
+        async for chapter in cursor:
+            chunk.append(chapter)
+            if len(chunk) >= TRANSLATION_JOB_CHUNK:
+                await translate_chapter_chunk(chunk, title_field, target_lang, job)
+                chunk = []
+        if chunk:
+            await translate_chapter_chunk(chunk, title_field, target_lang, job)
+        job["status"] = "completed"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = datetime.now()
+
+async def translate_chapter_chunk(chapters: List[Dict], field: str, target_lang: str, job: Dict[str, Any]):
+    translations = await translator.translate_many([c.get("title", "") for c in chapters], target_lang)
+    updates = [
+        UpdateOne({"id": chapter["id"]}, touch({"$set": {field: translation}}))
+        for chapter, translation in zip(chapters, translations) if translation
+    ]
+    if updates:
+        await db.chapters.bulk_write(updates, ordered=False)
+        response_cache.invalidate(f"manga:{job['manga_id']}", *[f"chapter:{c['id']}" for c in chapters])
+    job["chapters_translated"] += len(updates)
+
+# Reading progress buffer
+class ProgressBuffer:
+    """Keeps the latest reading position per (user, manga) and writes them in bulk"""
+
+    def __init__(self, interval: float, max_entries: int):
+        self.interval = interval
+        self.max_entries = max_entries
+        self.entries: Dict[tuple, Dict[str, Any]] = {}
+        self.oldest_write: Optional[float] = None
+        self.wake = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.counters = {
+            "updates": 0, "flushes": 0, "flushed_entries": 0, "failed_flushes": 0,
+            "last_batch_size": 0, "max_batch_size": 0, "last_flush_lag_ms": 0.0, "max_flush_lag_ms": 0.0,
+        }
+
+    def put(self, progress: Dict[str, Any]):
+        self.entries[(progress["user"], progress["manga_id"])] = progress
+        self.counters["updates"] += 1
+        if self.oldest_write is None:
+            self.oldest_write = time.monotonic()
+        if len(self.entries) >= self.max_entries:
+            self.wake.set()
+
+    def get(self, user: str, manga_id: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get((user, manga_id))
+
+    async def flush(self):
+        async with self.lock:
+            if not self.entries:
+                return
+            batch, self.entries = self.entries, {}
+            oldest, self.oldest_write = self.oldest_write, None
+            try:
+                await db.reading_progress.bulk_write([
+                    UpdateOne({"user": user, "manga_id": manga_id}, touch({"$set": progress}), upsert=True)
+                    for (user, manga_id), progress in batch.items()
+                ], ordered=False)
+            except Exception as e:
+                # Put back whatever was not superseded meanwhile and retry on the next tick
+                for key, progress in batch.items():
+                    self.entries.setdefault(key, progress)
+                self.oldest_write = oldest if self.oldest_write is None else min(oldest, self.oldest_write)
+                self.counters["failed_flushes"] += 1
+                logger.warning("Reading progress flush failed: %s", e)
+                return
+            lag_ms = round((time.monotonic() - oldest) * 1000, 1) if oldest else 0.0
+            self.counters["flushes"] += 1
+            self.counters["flushed_entries"] += len(batch)
+            self.counters["last_batch_size"] = len(batch)
+            self.counters["max_batch_size"] = max(self.counters["max_batch_size"], len(batch))
+            self.counters["last_flush_lag_ms"] = lag_ms
+            self.counters["max_flush_lag_ms"] = max(self.counters["max_flush_lag_ms"], lag_ms)
+
+    async def run(self):
+        """Flush every interval, or early once the buffer is full"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = self.counters["flushes"]
+        return {
+            **self.counters,
+            "pending": len(self.entries),
+            "avg_batch_size": round(self.counters["flushed_entries"] / flushes, 2) if flushes else 0.0,
+            "interval": self.interval,
+            "max_entries": self.max_entries,
+        }
+
+progress_buffer = ProgressBuffer(PROGRESS_FLUSH_INTERVAL, PROGRESS_FLUSH_MAX)
+
+# Shared HTTP client
+http_session: Optional[aiohttp.ClientSession] = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the pooled aiohttp session, creating it on first use"""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=DOWNLOAD_MAX_CONCURRENCY * 2,
+            limit_per_host=DOWNLOAD_PER_HOST_CONCURRENCY * 2,
+            ttl_dns_cache=300,
+        )
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return http_session
+
+# Background tasks are kept referenced here so they are not garbage collected mid-run
+background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Schedule a coroutine in the background and keep a reference to it"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Source health
+source_health: Dict[str, Dict[str, Any]] = {}
+
+async def probe_source_url(url: str) -> Dict[str, Any]:
+    """Check that a source URL answers, without blocking the event loop"""
+    session = get_http_session()
+    timeout = aiohttp.ClientTimeout(total=SOURCE_PROBE_TIMEOUT)
+    started = time.monotonic()
+    result = {"status": "down", "http_status": None, "latency_ms": None, "error": None}
+    try:
+        async with session.head(url, timeout=timeout, allow_redirects=True) as response:
+            http_status = response.status
+        if http_status in (405, 501):
+            # Some servers refuse HEAD; fall back to a GET without reading the body
+            async with session.get(url, timeout=timeout, allow_redirects=True) as response:
+                http_status = response.status
+        result["http_status"] = http_status
+        result["status"] = "up" if http_status < 400 else "down"
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        result["error"] = str(e) or e.__class__.__name__
+    result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    observe_outbound(urlparse(url).netloc, "probe", started, failed=result["status"] != "up")
+    return result
+
+async def check_source_health(source: Dict) -> Dict[str, Any]:
+    """Probe one source and record the outcome"""
+    result = await probe_source_url(source["url"])
+    now = datetime.now()
+    previous = source_health.get(source["id"], {})
+    health = {
+        "source_id": source["id"],
+        "url": source["url"],
+        **result,
+        "last_checked": now,
+        "last_success": now if result["status"] == "up" else previous.get("last_success"),
+        "consecutive_failures": 0 if result["status"] == "up" else previous.get("consecutive_failures", 0) + 1,
+    }
+    source_health[source["id"]] = health
+    try:
+        await db.source_health.update_one({"source_id": source["id"]}, {"$set": health}, upsert=True)
+    except Exception:
+        pass
+    return health
+
+async def all_enabled_sources() -> List[Dict]:
+    """Built-in sources plus enabled custom sources"""
+    custom_sources = await db.sources.find({"enabled": {"$ne": False}}, {"_id": 0}).to_list(length=None)
+    return BUILT_IN_SOURCES + custom_sources
+
+async def probe_all_sources() -> List[Dict[str, Any]]:
+    """Probe every enabled source concurrently"""
+    sources = await all_enabled_sources()
+    return await asyncio.gather(*[check_source_health(source) for source in sources])
+
+async def source_health_loop():
+    """Re-probe sources on a fixed interval"""
+    while True:
+        try:
+            await probe_all_sources()
+        except Exception as e:
+            logger.warning("Source health probe failed: %s", e)
+        await asyncio.sleep(SOURCE_HEALTH_INTERVAL)
+
+def source_is_down(source: Dict) -> bool:
+    health = source_health.get(source.get("id"))
+    return bool(health) and health["consecutive_failures"] >= SOURCE_DOWN_THRESHOLD
+
+def source_rank_key(source_id: str, observed_latency_ms: float = 0.0) -> tuple:
+    """Sort key: healthy, fast sources first; unprobed sources after them"""
+    health = source_health.get(source_id)
+    if not health or health["latency_ms"] is None:
+        return (1, observed_latency_ms)
+    return (0 if health["status"] == "up" else 2, health["latency_ms"])
+
+def rank_sources(sources: List[Dict]) -> List[Dict]:
+    """Healthy, fast sources first; unprobed sources after them"""
+    return sorted(sources, key=lambda source: source_rank_key(source.get("id")))
+
+# Search result cache
+class SearchCache:
+    """Bounded LRU of search results with TTL and stale-while-revalidate"""
+
+    def __init__(self, max_entries: int, ttl: float, stale_ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.refreshing = set()
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "refreshes": 0, "mongo_hits": 0}
+
+    def get(self, key: tuple):
+        """Return (results, state) where state is fresh, stale or miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, "miss"
+        results, stored_at = entry
+        age = time.time() - stored_at
+        if age > self.ttl + self.stale_ttl:
+            del self.entries[key]
+            return None, "miss"
+        self.entries.move_to_end(key)
+        return results, "fresh" if age <= self.ttl else "stale"
+
+    def put(self, key: tuple, results: List[Dict], stored_at: float = None):
+        self.entries[key] = (results, stored_at or time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        hit_ratio = (self.counters["hits"] + self.counters["stale_hits"]) / lookups if lookups else 0.0
+        return {
+            **self.counters,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hit_ratio": round(hit_ratio, 4),
+            "mongo_tier": SEARCH_CACHE_MONGO,
+        }
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL)
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a search query"""
+    return " ".join(query.lower().split())
+
+def search_cache_key(source: Dict, query: str) -> tuple:
+    return (source.get("id") or source["url"], normalize_query(query))
+
+async def load_search_cache_entry(key: tuple):
+    """Read an entry from the MongoDB second tier into memory"""
+    if not SEARCH_CACHE_MONGO:
+        return None
+    try:
+        doc = await db.search_cache.find_one({"source": key[0], "query": key[1]}, {"_id": 0})
+    except Exception:
+        return None
+    if not doc:
+        return None
+    stored_at = doc["stored_at"].timestamp()
+    if time.time() - stored_at > search_cache.ttl + search_cache.stale_ttl:
+        return None
+    search_cache.put(key, doc["results"], stored_at)
+    search_cache.counters["mongo_hits"] += 1
+    return search_cache.get(key)
+
+async def store_search_cache_entry(key: tuple, results: List[Dict]):
+    search_cache.put(key, results)
+    if SEARCH_CACHE_MONGO:
+        try:
+            await db.search_cache.update_one(
+                {"source": key[0], "query": key[1]},
+                {"$set": {"results": results, "stored_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception:
+            pass
+
+async def refresh_search_cache_entry(key: tuple, source: Dict, query: str):
+    """Re-fetch a stale entry in the background"""
+    try:
+        results = await asyncio.wait_for(fetch_manga_from_source(source["url"], query), SEARCH_SOURCE_TIMEOUT)
+        await store_search_cache_entry(key, results)
+        search_cache.counters["refreshes"] += 1
+    except Exception:
+        pass
+    finally:
+        search_cache.refreshing.discard(key)
+
+async def cached_fetch_from_source(source: Dict, query: str) -> List[Dict]:
+    """fetch_manga_from_source behind the search cache"""
+    key = search_cache_key(source, query)
+    results, state = search_cache.get(key)
+    if state == "miss":
+        results, state = await load_search_cache_entry(key) or (None, "miss")
+
+    if state == "fresh":
+        search_cache.counters["hits"] += 1
+        return results
+    if state == "stale":
+        search_cache.counters["stale_hits"] += 1
+        if key not in search_cache.refreshing:
+            search_cache.refreshing.add(key)
+            spawn_background(refresh_search_cache_entry(key, source, query))
+        return results
+
+    search_cache.counters["misses"] += 1
+    results = await fetch_manga_from_source(source["url"], query)
+    await store_search_cache_entry(key, results)
+    return results
+
+async def search_source(source: Dict, query: str) -> Dict[str, Any]:
+    """Query one source under the per-source timeout"""
+    started = time.monotonic()
+    outcome = {"source_id": source.get("id"), "source_name": source.get("name"), "status": "ok", "partial": False, "results": []}
+    try:
+        outcome["results"] = await asyncio.wait_for(
+            cached_fetch_from_source(source, query), SEARCH_SOURCE_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        outcome.update(status="timeout", partial=True)
+    except Exception as e:
+        outcome.update(status="error", partial=True, error=str(e))
+    observe_outbound(source.get("id") or source["url"], "search", started, failed=outcome["status"] != "ok")
+    outcome["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return outcome
+
+async def iter_source_searches(sources: List[Dict], query: str, skip_down: bool = True):
+    """Query all sources concurrently, yielding each outcome as soon as it arrives"""
+    if skip_down:
+        for source in [s for s in sources if source_is_down(s)]:
+            yield {
+                "source_id": source.get("id"), "source_name": source.get("name"),
+                "status": "skipped", "partial": True, "results": [], "elapsed_ms": 0.0,
+            }
+        sources = rank_sources([s for s in sources if not source_is_down(s)])
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SEARCH_DEADLINE
+    pending = {asyncio.create_task(search_source(source, query)): source for source in sources}
+    try:
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.pop(task)
+                yield task.result()
+        # Whatever is still running missed the overall deadline
+        for task, source in list(pending.items()):
+            task.cancel()
+            pending.pop(task)
+            yield {
+                "source_id": source.get("id"), "source_name": source.get("name"),
+                "status": "timeout", "partial": True, "results": [],
+                "elapsed_ms": round(SEARCH_DEADLINE * 1000, 1),
+            }
+    finally:
+        for task in pending:
+            task.cancel()
+
+# Local catalog index
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]")
+ARABIC_LETTER_VARIANTS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه", "\u0640": None,
+})
+NON_WORD = re.compile(r"[^\w]+")
+
+def normalize_search_text(text: str) -> str:
+    """Fold case, Arabic hamza/alef variants, tatweel and diacritics"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = ARABIC_DIACRITICS.sub("", text).translate(ARABIC_LETTER_VARIANTS)
+    return NON_WORD.sub(" ", text).replace("_", " ").strip()
+
+def search_tokens(text: str) -> List[str]:
+    return normalize_search_text(text).split()
+
+def token_trigrams(token: str) -> set:
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def typo_budget(token: str) -> int:
+    """Edits a query token may be away from an indexed token"""
+    if len(token) < 3:
+        return 0
+    return 2 if len(token) >= CATALOG_TYPO_LONG_TOKEN else 1
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, row = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous[j - 2] + 1)  # transposition
+        if min(current) > limit:
+            return limit + 1
+        previous, row = row, current
+    return min(row[-1], limit + 1)
+
+class CatalogIndex:
+    """In-process inverted index over db.manga for offline search
+
+    Tokens map to per-manga field weights; a trigram index over the token
+    vocabulary picks candidates for misspelled query words, which match when
+    within typo_budget() edits. Documents are
+    re-indexed whenever this process writes them and the whole index is
+    rebuilt every CATALOG_INDEX_REFRESH seconds.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.trigrams: Dict[str, set] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.doc_tokens: Dict[str, set] = {}
+        self.ready = False
+        self.built_at = None
+        self.counters = {"searches": 0, "fuzzy_expansions": 0, "upserts": 0, "removals": 0, "rebuilds": 0}
+
+    def _add_token(self, token: str, manga_id: str, weight: float):
+        posting = self.postings.get(token)
+        if posting is None:
+            posting = self.postings[token] = {}
+            for gram in token_trigrams(token):
+                self.trigrams.setdefault(gram, set()).add(token)
+        posting[manga_id] = posting.get(manga_id, 0.0) + weight
+
+    def _drop_token(self, token: str, manga_id: str):
+        posting = self.postings.get(token)
+        if posting is None:
+            return
+        posting.pop(manga_id, None)
+        if not posting:
+            del self.postings[token]
+            for gram in token_trigrams(token):
+                tokens = self.trigrams.get(gram)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.trigrams[gram]
+
+    def upsert(self, manga: Dict[str, Any]):
+        """(Re)index one manga document"""
+        manga_id = manga["id"]
+        self.remove(manga_id, count=False)
+        tokens = set()
+        for field, weight in CATALOG_FIELD_WEIGHTS.items():
+            for token in search_tokens(manga.get(field, "")):
+                self._add_token(token, manga_id, weight)
+                tokens.add(token)
+        self.doc_tokens[manga_id] = tokens
+        self.docs[manga_id] = {field: manga.get(field) for field in CATALOG_SUMMARY_FIELDS}
+        self.counters["upserts"] += 1
+
+    def update_summary(self, manga_id: str, **fields):
+        """Update non-indexed fields shown in results, e.g. download_status"""
+        doc = self.docs.get(manga_id)
+        if doc is not None:
+            doc.update({k: v for k, v in fields.items() if k in CATALOG_SUMMARY_FIELDS})
+
+    def remove(self, manga_id: str, count: bool = True):
+        for token in self.doc_tokens.pop(manga_id, ()):
+            self._drop_token(token, manga_id)
+        if self.docs.pop(manga_id, None) is not None and count:
+            self.counters["removals"] += 1
+
+    def expand(self, token: str) -> Dict[str, float]:
+        """Vocabulary tokens matching a query token, with their similarity"""
+        matches = {token: 1.0} if token in self.postings else {}
+        budget = typo_budget(token)
+        candidates = set()
+        for gram in token_trigrams(token):
+            candidates.update(self.trigrams.get(gram, ()))
+        for candidate in candidates:
+            if candidate == token:
+                continue
+            similarity = 0.0
+            if candidate.startswith(token):
+                similarity = 0.8  # typeahead: "nar" finds "naruto"
+            distance = edit_distance(token, candidate, budget)
+            if distance <= budget:
+                similarity = max(similarity, 1 - distance / max(len(token), len(candidate)))
+            if similarity:
+                matches[candidate] = similarity
+        if len(matches) > (token in self.postings):
+            self.counters["fuzzy_expansions"] += 1
+        return matches
+
+    def search(self, query: str, limit: int = CATALOG_SEARCH_LIMIT, downloaded_only: bool = False) -> List[Dict[str, Any]]:
+        """Rank manga by the weighted best match of every query token"""
+        self.counters["searches"] += 1
+        scores: Dict[str, float] = {}
+        for token in set(search_tokens(query)):
+            best: Dict[str, float] = {}
+            for candidate, similarity in self.expand(token).items():
+                for manga_id, weight in self.postings[candidate].items():
+                    score = weight * similarity
+                    if score > best.get(manga_id, 0.0):
+                        best[manga_id] = score
+            for manga_id, score in best.items():
+                scores[manga_id] = scores.get(manga_id, 0.0) + score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        results = []
+        for manga_id, score in ranked:
+            doc = self.docs[manga_id]
+            if downloaded_only and doc.get("download_status") not in ("downloading", "completed"):
+                continue
+            results.append({**doc, "score": round(score, 3)})
+            if len(results) >= limit:
+                break
+        return results
+
+    async def rebuild(self):
+        """Index every manga from MongoDB, swapping in the result when done"""
+        fresh = CatalogIndex()
+        projection = {"_id": 0, **{field: 1 for field in set(CATALOG_SUMMARY_FIELDS) | set(CATALOG_FIELD_WEIGHTS)}}
+        async for manga in db.manga.find({}, projection).batch_size(1000):
+            fresh.upsert(manga)
+        self.postings, self.trigrams = fresh.postings, fresh.trigrams
+        self.docs, self.doc_tokens = fresh.docs, fresh.doc_tokens
+        self.ready = True
+        self.built_at = datetime.now()
+        self.counters["rebuilds"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "ready": self.ready, "built_at": self.built_at, "documents": len(self.docs),
+                "tokens": len(self.postings), "trigrams": len(self.trigrams)}
+
+catalog_index = CatalogIndex()
+
+async def reindex_manga(manga_id: str):
+    """Refresh one manga in the local index after a write"""
+    manga = await db.manga.find_one({"id": manga_id}, {"_id": 0})
+    if manga:
+        catalog_index.upsert(manga)
+    else:
+        catalog_index.remove(manga_id)
+
+async def catalog_index_loop():
+    """Build the local catalog index, then rebuild it periodically"""
+    while True:
+        try:
+            await catalog_index.rebuild()
+        except Exception as e:
+            logger.warning("Catalog index rebuild failed: %s", e)
+        await asyncio.sleep(CATALOG_INDEX_REFRESH)
+
+# Cross-source result merging
+def series_key(result: Dict) -> str:
+    """Normalized title identifying the same work across sources"""
+    return normalize_search_text(result.get("title") or result.get("title_ar") or result.get("id", ""))
+
+def series_id_for(key: str) -> str:
+    return f"series_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+class SearchMerger:
+    """Clusters search results from several sources into one entry per series
+
+    Each series keeps the result from its best-ranked source (source health,
+    then latency) and lists the other sources carrying it as alternatives.
+    """
+
+    def __init__(self):
+        self.series: "OrderedDict[str, List[tuple]]" = OrderedDict()
+
+    def add(self, outcome: Dict[str, Any]) -> tuple:
+        """Fold one source outcome in; returns (new series, re-merged series seen before)"""
+        rank = source_rank_key(outcome.get("source_id"), outcome.get("elapsed_ms", 0.0))
+        new_keys, grown = [], []
+        for result in outcome.get("results", []):
+            key = series_key(result)
+            entry = (rank, result, outcome)
+            if key not in self.series:
+                self.series[key] = [entry]
+                new_keys.append(key)
+            else:
+                self.series[key].append(entry)
+                if key not in new_keys and key not in grown:
+                    grown.append(key)
+        return [self.merged(key) for key in new_keys], [self.merged(key) for key in grown]
+
+    def merged(self, key: str) -> Dict[str, Any]:
+        entries = sorted(self.series[key], key=lambda entry: entry[0])
+        primary = entries[0][1]
+        return {
+            **primary,
+            "series_id": series_id_for(key),
+            "alternatives": [{
+                "id": result["id"],
+                "source": result.get("source"),
+                "source_id": outcome.get("source_id"),
+                "source_name": outcome.get("source_name"),
+                "elapsed_ms": outcome.get("elapsed_ms"),
+            } for _, result, outcome in entries[1:]],
+        }
+
+    def results(self) -> List[Dict[str, Any]]:
+        return [self.merged(key) for key in self.series]
+
+# Storage ledger
+# One document per downloaded chapter plus running totals per manga and overall,
+# so download stats never have to walk DOWNLOADS_DIR.
+LEDGER_TOTAL_ID = "total"
+
+def ledger_manga_id(manga_id: str) -> str:
+    return f"manga:{manga_id}"
+
+def ledger_chapter_id(chapter_id: str) -> str:
+    return f"chapter:{chapter_id}"
+
+async def ledger_apply(manga_id: str, delta_bytes: int, delta_chapters: int):
+    """Apply a size change to the manga and global totals"""
+    if not delta_bytes and not delta_chapters:
+        return
+    change = {"$inc": {"bytes": delta_bytes, "chapters": delta_chapters}}
+    await db.storage_ledger.update_one({"_id": ledger_manga_id(manga_id)}, change, upsert=True)
+    await db.storage_ledger.update_one({"_id": LEDGER_TOTAL_ID}, change, upsert=True)
+
+async def ledger_record_chapter(chapter: Dict, size: int):
+    """Record the on-disk size of a completed chapter"""
+    previous = await db.storage_ledger.find_one_and_update(
+        {"_id": ledger_chapter_id(chapter["id"])},
+        {"$set": {"manga_id": chapter["manga_id"], "bytes": size, "recorded_at": datetime.now()}},
+        upsert=True
+    )
+    storage_evictor.notify()
+    if previous:
+        await ledger_apply(chapter["manga_id"], size - previous.get("bytes", 0), 0)
+    else:
+        await ledger_apply(chapter["manga_id"], size, 1)
+
+async def ledger_remove_chapter(chapter_id: str):
+    """Forget a chapter whose files were deleted"""
+    previous = await db.storage_ledger.find_one_and_delete({"_id": ledger_chapter_id(chapter_id)})
+    if previous:
+        await ledger_apply(previous["manga_id"], -previous.get("bytes", 0), -1)
+
+async def ledger_totals(manga_id: str = None) -> Dict[str, int]:
+    """Byte and chapter totals, overall or for one manga"""
+    key = ledger_manga_id(manga_id) if manga_id else LEDGER_TOTAL_ID
+    doc = await db.storage_ledger.find_one({"_id": key})
+    return {"bytes": doc.get("bytes", 0) if doc else 0, "chapters": doc.get("chapters", 0) if doc else 0}
+
+async def disk_bytes_used() -> int:
+    """Bytes the downloads occupy on disk
+
+    Ledger sizes are logical, counting a deduplicated page once per chapter
+    that links it; the dedup savings are the difference.
+    """
+    return max((await ledger_totals())["bytes"] - (await dedup_totals())["bytes_saved"], 0)
+
+def scan_directory_size(path: str) -> int:
+    """Total size of the files under path, using os.scandir"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    total += scan_directory_size(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return total
+
+def scan_chapter_sizes(paths: List[str]) -> List[int]:
+    """Sizes of several chapter directories or archives; meant to run in a worker thread"""
+    sizes = []
+    for path in paths:
+        if path and os.path.isfile(path):
+            sizes.append(os.path.getsize(path))
+        else:
+            sizes.append(scan_directory_size(path) if path else 0)
+    return sizes
+
+async def reconcile_storage_ledger() -> Dict[str, int]:
+    """Rebuild the ledger from the files actually on disk"""
+    before = await ledger_totals()
+    chapters = await db.chapters.find(
+        {"download_status": "completed"}, {"_id": 0, "id": 1, "manga_id": 1, "download_path": 1}
+    ).to_list(length=None)
+    sizes = await asyncio.get_running_loop().run_in_executor(
+        None, scan_chapter_sizes, [chapter.get("download_path", "") for chapter in chapters]
+    )
+
+    recorded = {}
+    async for doc in db.storage_ledger.find({"_id": {"$regex": "^(chapter|manga):"}}):
+        recorded[doc["_id"]] = doc
+
+    writes = []
+    chapter_updates = []
+    manga_totals: Dict[str, Dict[str, int]] = {}
+    for chapter, size in zip(chapters, sizes):
+        totals = manga_totals.setdefault(chapter["manga_id"], {"bytes": 0, "chapters": 0})
+        totals["bytes"] += size
+        totals["chapters"] += 1
+        key = ledger_chapter_id(chapter["id"])
+        if recorded.pop(key, {}).get("bytes") != size:
+            writes.append(UpdateOne({"_id": key}, {"$set": {"manga_id": chapter["manga_id"], "bytes": size}}, upsert=True))
+            chapter_updates.append(UpdateOne({"id": chapter["id"]}, touch({"$set": {"size": size}})))
+    for manga_id, totals in manga_totals.items():
+        key = ledger_manga_id(manga_id)
+        recorded.pop(key, None)
+        writes.append(ReplaceOne({"_id": key}, totals, upsert=True))
+
+    # Whatever is left in the ledger no longer exists on disk
+    if recorded:
+        writes.append(DeleteMany({"_id": {"$in": list(recorded)}}))
+    total = {"bytes": sum(sizes), "chapters": len(chapters)}
+    writes.append(ReplaceOne({"_id": LEDGER_TOTAL_ID}, total, upsert=True))
+
+    await db.storage_ledger.bulk_write(writes, ordered=False)
+    if chapter_updates:
+        await db.chapters.bulk_write(chapter_updates, ordered=False)
+    manga_updates = [UpdateOne({"id": m, "total_size": {"$ne": t["bytes"]}}, touch({"$set": {"total_size": t["bytes"]}}))
+                     for m, t in manga_totals.items()]
+    if manga_updates:
+        await db.manga.bulk_write(manga_updates, ordered=False)
+    if chapter_updates or manga_updates:
+        response_cache.clear()
+    dedup = await refresh_dedup_ledger()
+
+    return {**total, "drift_bytes": total["bytes"] - before["bytes"], "dedup_bytes_saved": dedup["bytes_saved"],
+            "dedup_objects_collected": dedup["collected"]}
+
+async def ledger_reconcile_loop():
+    """Periodically correct ledger drift"""
+    while True:
+        try:
+            result = await reconcile_storage_ledger()
+            if result["drift_bytes"]:
+                logger.info("Storage ledger corrected by %d bytes", result["drift_bytes"])
+        except Exception as e:
+            logger.warning("Storage ledger reconcile failed: %s", e)
+        await asyncio.sleep(LEDGER_RECONCILE_INTERVAL)
+
+def remove_paths(paths: List[str]):
+    """Delete files and directory trees, ignoring the ones already gone"""
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def chapter_paths(chapter: Dict) -> List[str]:
+    """Every place a chapter's files may live: its page directory, archive and recorded path"""
+    paths = {chapter_download_dir(chapter), chapter_archive_path(chapter)}
+    if chapter.get("download_path"):
+        paths.add(chapter["download_path"])
+    return sorted(paths)
+
+async def delete_chapter_files(chapter: Dict) -> int:
+    """Remove a downloaded chapter from disk and from the ledger; returns the bytes freed"""
+    archive = chapter_archive_path(chapter)
+    paths = chapter_paths(chapter)
+    loop = asyncio.get_running_loop()
+    usage = await loop.run_in_executor(None, measure_page_links, paths)
+    await loop.run_in_executor(None, remove_paths, paths)
+    if usage["shared"]:
+        await db.storage_ledger.update_one({"_id": DEDUP_LEDGER_ID}, {"$inc": {"bytes_saved": -usage["shared"]}})
+    archive_indexes.pop(archive, None)
+    await db.chapters.update_one(
+        {"id": chapter["id"]},
+        touch({"$set": {"download_status": "not_downloaded", "download_path": "", "size": 0}})
+    )
+    invalidate_chapter(chapter)
+    await ledger_remove_chapter(chapter["id"])
+    return usage["freed"]
+
+# Page deduplication
+# A page's first copy is hardlinked into PAGE_STORE_DIR under its SHA-256;
+# later copies with the same digest are replaced by links to that object.
+# The filesystem link count is the reference count: an object whose count
+# drops to 1 is no longer used by any chapter and is collected on recount.
+hash_pool: Optional[ThreadPoolExecutor] = None
+
+def get_hash_pool() -> ThreadPoolExecutor:
+    global hash_pool
+    if hash_pool is None:
+        hash_pool = ThreadPoolExecutor(max_workers=DEDUP_HASH_WORKERS, thread_name_prefix="page-hash")
+    return hash_pool
+
+def page_object_path(digest: str) -> str:
+    return os.path.join(PAGE_STORE_DIR, digest[:2], digest)
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def new_dedup_delta() -> Dict[str, int]:
+    return {"objects": 0, "stored_bytes": 0, "bytes_saved": 0}
+
+def dedup_page_file(path: str, digest: Optional[str] = None) -> Dict[str, int]:
+    """Move one page into the content store; returns the change to the dedup counters
+
+    digest is the page's SHA-256 when it was hashed while downloading; the
+    file is read and hashed otherwise.
+    """
+    delta = new_dedup_delta()
+    try:
+        stat = os.stat(path)
+        if stat.st_nlink > 1:
+            return delta  # already linked to an object
+        obj = page_object_path(digest or file_sha256(path))
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        for _ in range(2):
+            try:
+                os.link(path, obj)
+                delta.update(objects=1, stored_bytes=stat.st_size)
+                return delta
+            except FileExistsError:
+                pass
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.link(obj, tmp)
+                os.replace(tmp, path)
+                delta["bytes_saved"] = stat.st_size
+                return delta
+            except FileNotFoundError:
+                continue  # the object was just collected; store this copy instead
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    except OSError as e:
+        logger.warning("Page dedup skipped for %s: %s", path, e)
+    return delta
+
+async def record_dedup_delta(total: Dict[str, int]):
+    if any(total.values()):
+        await db.storage_ledger.update_one({"_id": DEDUP_LEDGER_ID}, {"$inc": total}, upsert=True)
+
+async def dedup_page(path: str, digest: Optional[str], total: Dict[str, int]):
+    """Link one freshly downloaded page into the store, adding its delta to total"""
+    delta = await asyncio.get_running_loop().run_in_executor(get_hash_pool(), dedup_page_file, path, digest)
+    for key, value in delta.items():
+        total[key] += value
+
+async def dedup_pages(paths: List[str]) -> Dict[str, int]:
+    """Hash and link pages in the hash pool, then record the savings"""
+    loop = asyncio.get_running_loop()
+    deltas = await asyncio.gather(*[loop.run_in_executor(get_hash_pool(), dedup_page_file, path) for path in paths])
+    total = {key: sum(delta[key] for delta in deltas) for key in ("objects", "stored_bytes", "bytes_saved")}
+    await record_dedup_delta(total)
+    return total
+
+def measure_page_links(paths: List[str]) -> Dict[str, int]:
+    """Split the files under paths by link count before they are removed
+
+    freed: bytes no other chapter links, returned to the disk once removed
+    and their store objects collected. shared: bytes another chapter still
+    links, which only reduce the dedup savings.
+    """
+    usage = {"freed": 0, "shared": 0}
+    seen = set()
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files.append(path)
+    for path in files:
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) in seen:
+            continue
+        seen.add((stat.st_dev, stat.st_ino))
+        usage["shared" if stat.st_nlink > 2 else "freed"] += stat.st_size
+    return usage
+
+def recount_page_store() -> Dict[str, int]:
+    """Collect unreferenced objects and recount the store from link counts"""
+    totals = {"objects": 0, "stored_bytes": 0, "bytes_saved": 0, "collected": 0}
+    try:
+        shards = list(os.scandir(PAGE_STORE_DIR))
+    except OSError:
+        return totals
+    for shard in shards:
+        if not shard.is_dir(follow_symlinks=False):
+            continue
+        with os.scandir(shard.path) as entries:
+            for entry in entries:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_nlink <= 1:
+                    os.remove(entry.path)
+                    totals["collected"] += 1
+                    continue
+                totals["objects"] += 1
+                totals["stored_bytes"] += stat.st_size
+                totals["bytes_saved"] += stat.st_size * (stat.st_nlink - 2)
+    return totals
+
+async def refresh_dedup_ledger() -> Dict[str, int]:
+    totals = await asyncio.get_running_loop().run_in_executor(None, recount_page_store)
+    await db.storage_ledger.replace_one(
+        {"_id": DEDUP_LEDGER_ID}, {key: totals[key] for key in ("objects", "stored_bytes", "bytes_saved")}, upsert=True
+    )
+    return totals
+
+async def dedup_existing_downloads() -> Dict[str, int]:
+    """One-off migration: move pages of already downloaded chapters into the store"""
+    totals = {"chapters": 0, "pages": 0, "bytes_saved": 0}
+    cursor = db.chapters.find({"download_status": "completed"}, {"_id": 0, "download_path": 1})
+    async for chapter in cursor.batch_size(500):
+        path = chapter.get("download_path", "")
+        if not path or not os.path.isdir(path):
+            continue  # not downloaded, or packed into a CBZ
+        pages = [entry.path for entry in os.scandir(path) if entry.is_file() and entry.name.startswith("page_")]
+        delta = await dedup_pages(pages)
+        totals["chapters"] += 1
+        totals["pages"] += len(pages)
+        totals["bytes_saved"] += delta["bytes_saved"]
+    recount = await refresh_dedup_ledger()
+    return {**totals, "objects": recount["objects"], "total_bytes_saved": recount["bytes_saved"],
+            "collected": recount["collected"]}
+
+async def dedup_totals() -> Dict[str, int]:
+    doc = await db.storage_ledger.find_one({"_id": DEDUP_LEDGER_ID}) or {}
+    return {key: max(doc.get(key, 0), 0) for key in ("objects", "stored_bytes", "bytes_saved")}
+
+# Storage quota
+class StorageEvictor:
+    """Keeps DOWNLOADS_DIR under its quota by deleting least-recently-read chapters
+
+    Usage comes from the storage ledger less the dedup savings, so checks
+    never walk the disk.
+    Manga are visited from least to most recently read, falling back to the
+    latest download for manga nobody has opened. Within a manga, chapters the
+    reader has already passed go first (farthest behind first), then the
+    chapters farthest ahead. Pinned chapters and manga, unfinished downloads
+    and each reader's current chapter plus QUOTA_KEEP_AHEAD chapters are
+    never evicted. A MongoDB lock keeps one evictor active across workers.
+    """
+
+    LOCK_ID = "evictor_lock"
+    MAX_PASSES = 3
+
+    def __init__(self):
+        self.owner = uuid.uuid4().hex
+        self.wake = asyncio.Event()
+        self.counters = {"runs": 0, "evicted_chapters": 0, "evicted_bytes": 0, "skipped_busy": 0, "last_run": None}
+
+    def notify(self):
+        self.wake.set()
+
+    def enabled(self) -> bool:
+        return DOWNLOAD_QUOTA_BYTES > 0 or DOWNLOAD_MIN_FREE_BYTES > 0
+
+    async def bytes_to_free(self) -> int:
+        used = await disk_bytes_used()
+        excess = 0
+        if DOWNLOAD_QUOTA_BYTES and used > DOWNLOAD_QUOTA_BYTES:
+            excess = used - int(DOWNLOAD_QUOTA_BYTES * QUOTA_LOW_WATERMARK)
+        if DOWNLOAD_MIN_FREE_BYTES:
+            free = shutil.disk_usage(DOWNLOADS_DIR).free
+            if free < DOWNLOAD_MIN_FREE_BYTES:
+                excess = max(excess, int(DOWNLOAD_MIN_FREE_BYTES / QUOTA_LOW_WATERMARK) - free)
+        return excess
+
+    async def acquire_lock(self) -> bool:
+        now = datetime.now()
+        try:
+            await db.storage_ledger.update_one(
+                {"_id": self.LOCK_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner,
+                          "expires_at": datetime.fromtimestamp(now.timestamp() + QUOTA_CHECK_INTERVAL * 2)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # held by another worker
+
+    async def reader_positions(self) -> Dict[str, Dict[str, Any]]:
+        """Per manga: latest read time and the chapter_number every reader is at"""
+        positions: Dict[str, Dict[str, Any]] = {}
+        progress = await db.reading_progress.find({}, {"_id": 0, "manga_id": 1, "chapter_id": 1, "timestamp": 1}).to_list(length=None)
+        progress.extend(progress_buffer.entries.values())
+        chapter_ids = list({p["chapter_id"] for p in progress if p.get("chapter_id")})
+        numbers = {c["id"]: c["chapter_number"] async for c in db.chapters.find(
+            {"id": {"$in": chapter_ids}}, {"_id": 0, "id": 1, "chapter_number": 1}
+        )}
+        for p in progress:
+            entry = positions.setdefault(p["manga_id"], {"last_read": datetime.min, "current": []})
+            if p.get("timestamp") and p["timestamp"] > entry["last_read"]:
+                entry["last_read"] = p["timestamp"]
+            if p.get("chapter_id") in numbers:
+                entry["current"].append(numbers[p["chapter_id"]])
+        return positions
+
+    @staticmethod
+    def chapter_order(chapters: List[Dict], current: List[float]) -> List[Dict]:
+        """Evictable chapters of one manga, first to go first"""
+        if not current:
+            # Nobody has started it: keep the opening chapters longest
+            return sorted(chapters, key=lambda c: -c["chapter_number"])
+        ordered = sorted(chapters, key=lambda c: c["chapter_number"])
+        protected = set()
+        for position in current:
+            ahead = [c["id"] for c in ordered if c["chapter_number"] >= position][:QUOTA_KEEP_AHEAD + 1]
+            protected.update(ahead)
+        lowest, highest = min(current), max(current)
+        behind = [c for c in ordered if c["chapter_number"] < lowest and c["id"] not in protected]
+        beyond = [c for c in ordered if c["chapter_number"] > highest and c["id"] not in protected]
+        return behind + beyond[::-1]
+
+    async def evict_chapter(self, chapter: Dict) -> Optional[int]:
+        """Delete one chapter unless it was pinned or changed meanwhile; returns the bytes freed"""
+        claimed = await db.chapters.find_one_and_update(
+            {"id": chapter["id"], "download_status": "completed", "pinned": {"$ne": True}},
+            touch({"$set": {"download_status": "evicting"}}),
+            projection={"_id": 0}
+        )
+        if not claimed:
+            self.counters["skipped_busy"] += 1
+            return None
+        # Measured from link counts: a page shared with another chapter frees nothing
+        freed = await delete_chapter_files(claimed)
+        self.counters["evicted_chapters"] += 1
+        self.counters["evicted_bytes"] += freed
+        return freed
+
+    async def run_once(self) -> Dict[str, int]:
+        """Evict until usage is back under the low watermark"""
+        result = {"freed_bytes": 0, "evicted_chapters": 0}
+        excess = await self.bytes_to_free()
+        if excess <= 0 or not await self.acquire_lock():
+            return result
+        self.counters["runs"] += 1
+        self.counters["last_run"] = datetime.now()
+
+        positions = await self.reader_positions()
+        pinned_manga = {m["id"] async for m in db.manga.find({"pinned": True}, {"_id": 0, "id": 1})}
+        recency: Dict[str, datetime] = {}
+        async for doc in db.storage_ledger.find({"_id": {"$regex": "^chapter:"}}, {"manga_id": 1, "recorded_at": 1}):
+            if doc["manga_id"] in pinned_manga:
+                continue
+            recorded = doc.get("recorded_at") or datetime.min
+            recency[doc["manga_id"]] = max(recency.get(doc["manga_id"], datetime.min), recorded)
+        for manga_id, position in positions.items():
+            if manga_id in recency and position["last_read"] > datetime.min:
+                recency[manga_id] = position["last_read"]
+
+        # Each pass frees what the link counts promise, then usage is measured
+        # again from the store and the disk in case the ledger was off
+        for _ in range(self.MAX_PASSES):
+            evicted = await self.evict_pass(excess, recency, positions, result)
+            if not evicted:
+                break
+            if PAGE_DEDUP:
+                await refresh_dedup_ledger()  # collect the objects those chapters held
+            excess = await self.bytes_to_free()
+            if excess <= 0:
+                break
+        if result["evicted_chapters"]:
+            logger.info("Storage quota: evicted %d chapters, %d bytes", result["evicted_chapters"], result["freed_bytes"])
+        return result
+
+    async def evict_pass(self, excess: int, recency: Dict[str, datetime], positions: Dict[str, Dict[str, Any]],
+                         result: Dict[str, int]) -> int:
+        """Evict in recency order until excess bytes are freed; returns the chapters evicted"""
+        freed_here = evicted = 0
+        for manga_id in sorted(recency, key=recency.get):
+            chapters = await db.chapters.find(
+                {"manga_id": manga_id, "download_status": "completed", "pinned": {"$ne": True}},
+                {"_id": 0, "id": 1, "chapter_number": 1}
+            ).to_list(length=None)
+            current = positions.get(manga_id, {}).get("current", [])
+            evicted_here = 0
+            for chapter in self.chapter_order(chapters, current):
+                freed = await self.evict_chapter(chapter)
+                if freed is not None:
+                    freed_here += freed
+                    evicted_here += 1
+                if freed_here >= excess:
+                    break
+            if evicted_here:
+                await refresh_manga_download_status(manga_id)
+                evicted += evicted_here
+            if freed_here >= excess:
+                break
+        result["freed_bytes"] += freed_here
+        result["evicted_chapters"] += evicted
+        return evicted
+
+    async def finish_interrupted(self):
+        """Complete evictions cut short by a restart"""
+        async for chapter in db.chapters.find({"download_status": "evicting"}, {"_id": 0}):
+            await delete_chapter_files(chapter)
+            await refresh_manga_download_status(chapter["manga_id"])
+
+    async def run(self):
+        try:
+            await self.finish_interrupted()
+        except Exception as e:
+            logger.warning("Could not finish interrupted evictions: %s", e)
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), QUOTA_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning("Storage eviction failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "quota_bytes": DOWNLOAD_QUOTA_BYTES, "min_free_bytes": DOWNLOAD_MIN_FREE_BYTES,
+                "low_watermark": QUOTA_LOW_WATERMARK, "keep_ahead": QUOTA_KEEP_AHEAD}
+
+storage_evictor = StorageEvictor()
+
+# Compact page lists
+# Chapter pages are stored as a plain URL list, or once compacted as a
+# PageRange / PageSuffixes document. Readers go through page_count/page_url
+# so a single page or the page count never expands the whole list.
+PAGE_LIST_MIN_PREFIX = 16  # shorter shared prefixes aren't worth a suffix array
+PAGE_NUMBER = re.compile(r"[0-9]+")
+
+def page_count(pages: Union[List[str], Dict[str, Any], None]) -> int:
+    if isinstance(pages, dict):
+        return pages["count"] if "count" in pages else len(pages["suffixes"])
+    return len(pages or [])
+
+def page_url(pages: Union[List[str], Dict[str, Any]], index: int) -> str:
+    """URL of one page, without expanding the list"""
+    if isinstance(pages, dict):
+        if "suffixes" in pages:
+            return pages["prefix"] + pages["suffixes"][index]
+        return f"{pages['prefix']}{pages['start'] + index:0{pages.get('width', 0)}d}{pages.get('suffix', '')}"
+    return pages[index]
+
+def iter_page_urls(pages: Union[List[str], Dict[str, Any], None]) -> Iterator[str]:
+    if not isinstance(pages, dict):
+        return iter(pages or [])
+    return (page_url(pages, index) for index in range(page_count(pages)))
+
+def expand_page_list(pages: Union[List[str], Dict[str, Any], None]) -> List[str]:
+    return list(iter_page_urls(pages))
+
+def expand_chapter_pages(chapter: Dict) -> Dict:
+    """Chapter with a compact page list turned back into plain URLs"""
+    if isinstance(chapter.get("pages"), dict):
+        chapter["pages"] = expand_page_list(chapter["pages"])
+    return chapter
+
+def compact_page_list(urls: List[str]) -> Union[List[str], Dict[str, Any]]:
+    """Smallest encoding of a page URL list; the list itself when nothing is gained"""
+    if len(urls) < 2:
+        return urls
+    prefix = os.path.commonprefix(urls)
+    suffix = os.path.commonprefix([url[len(prefix):][::-1] for url in urls])[::-1]
+
+    # Sequentially numbered pages collapse to a range
+    head = prefix.rstrip("0123456789")
+    tail = suffix.lstrip("0123456789")
+    numbers = [url[len(head):len(url) - len(tail)] for url in urls]
+    if all(PAGE_NUMBER.fullmatch(number) for number in numbers):
+        width = len(numbers[0]) if len({len(number) for number in numbers}) == 1 else 0
+        page_range = {"prefix": head, "start": int(numbers[0]), "count": len(urls), "width": width, "suffix": tail}
+        if expand_page_list(page_range) == urls:
+            return page_range
+
+    if len(prefix) >= PAGE_LIST_MIN_PREFIX:
+        return {"prefix": prefix, "suffixes": [url[len(prefix):] for url in urls]}
+    return urls
+
+async def compact_chapter_pages() -> Dict[str, int]:
+    """One-off migration: rewrite plain page lists in their compact form"""
+    totals = {"chapters": 0, "compacted": 0, "ranges": 0, "bytes_before": 0, "bytes_after": 0}
+    updates = []
+    cursor = db.chapters.find({"pages": {"$type": "array"}}, {"_id": 0, "id": 1, "pages": 1})
+    async for chapter in cursor.batch_size(500):
+        totals["chapters"] += 1
+        pages = compact_page_list(chapter["pages"])
+        if not isinstance(pages, dict):
+            continue
+        totals["compacted"] += 1
+        totals["ranges"] += "count" in pages
+        totals["bytes_before"] += len(bson_encode({"pages": chapter["pages"]}))
+        totals["bytes_after"] += len(bson_encode({"pages": pages}))
+        # Match the old list so a concurrent rewrite of the chapter wins
+        updates.append(UpdateOne({"id": chapter["id"], "pages": chapter["pages"]}, {"$set": {"pages": pages}}))
+        if len(updates) >= 500:
+            await db.chapters.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.chapters.bulk_write(updates, ordered=False)
+    return totals
+
+# Download engine
+download_semaphore = asyncio.Semaphore(DOWNLOAD_MAX_CONCURRENCY)
+host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def get_host_semaphore(url: str) -> asyncio.Semaphore:
+    """Per-host concurrency limiter for page downloads"""
+    host = urlparse(url).netloc
+    if host not in host_semaphores:
+        host_semaphores[host] = asyncio.Semaphore(DOWNLOAD_PER_HOST_CONCURRENCY)
+    return host_semaphores[host]
+
+def chapter_download_dir(chapter: Dict) -> str:
+    """Directory holding the downloaded pages of a chapter"""
+    return os.path.join(DOWNLOADS_DIR, chapter["manga_id"], f"chapter_{chapter['chapter_number']}")
+
+def page_filename(index: int, url: str) -> str:
+    """Local file name for a page, keeping the remote extension"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if ext not in (".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"):
+        ext = ".jpg"
+    return f"page_{index:04d}{ext}"
+
+def new_download_counters() -> Dict[str, Any]:
+    """Progress counters a worker fills in while downloading one chapter"""
+    return {
+        "status": "downloading",
+        "completed_chapters": 0,
+        "failed_chapters": 0,
+        "pages_downloaded": 0,
+        "pages_skipped": 0,
+        "bytes_downloaded": 0,
+        "started_at": datetime.now(),
+        "finished_at": None,
+        "error": None,
+    }
+
+def download_job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job state plus throughput in pages/s and MB/s"""
+    summary = dict(job)
+    elapsed = 0.0
+    if job["started_at"]:
+        end = job["finished_at"] or datetime.now()
+        elapsed = max((end - job["started_at"]).total_seconds(), 1e-6)
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["pages_per_second"] = round(job["pages_downloaded"] / elapsed, 2) if elapsed else 0.0
+    summary["mb_per_second"] = round(job["bytes_downloaded"] / (1024 * 1024) / elapsed, 3) if elapsed else 0.0
+    return summary
+
+async def download_page(url: str, dest: str, job: Dict[str, Any], dedup: Optional[Dict[str, int]] = None) -> int:
+    """Stream one page to disk, resuming a partial .part file when possible
+
+    With a dedup total, the page is hashed as it streams in and linked into
+    the page store as soon as it is complete.
+    """
+    if os.path.exists(dest) and os.path.getsize(dest) > 0:
+        job["pages_skipped"] += 1
+        if dedup is not None:
+            await dedup_page(dest, None, dedup)  # no-op unless an earlier attempt stopped before linking it
+        return os.path.getsize(dest)
+
+    part = dest + ".part"
+    session = get_http_session()
+    last_error = None
+    digest = None
+    for attempt in range(DOWNLOAD_RETRIES):
+        if attempt:
+            # Back off without holding a slot
+            await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        # Host slot first, so pages queued behind a busy host don't tie up global slots
+        async with get_host_semaphore(url), download_semaphore:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            started = time.monotonic()
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 416:
+                        # The partial file already holds the whole body
+                        break
+                    if response.status >= 400:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history,
+                            status=response.status, message=response.reason or "",
+                        )
+                    mode = "ab" if offset and response.status == 206 else "wb"
+                    # Resumed pages miss their first bytes here and are hashed from the file instead
+                    hasher = hashlib.sha256() if dedup is not None and mode == "wb" else None
+                    written = 0
+                    async with aiofiles.open(part, mode) as f:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await f.write(chunk)
+                            if hasher is not None:
+                                hasher.update(chunk)
+                            written += len(chunk)
+                    digest = hasher.hexdigest() if hasher else None
+                    job["bytes_downloaded"] += written
+                    metrics.inc("download_bytes_total", value=written)
+                observe_outbound(urlparse(url).netloc, "download", started)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                observe_outbound(urlparse(url).netloc, "download", started, failed=True)
+                last_error = e
+    else:
+        raise last_error
+
+    os.replace(part, dest)
+    job["pages_downloaded"] += 1
+    metrics.inc("download_pages_total")
+    size = os.path.getsize(dest)
+    if dedup is not None:
+        await dedup_page(dest, digest, dedup)
+    return size
+
+async def gather_or_cancel(coros) -> List[Any]:
+    """Like gather(), but cancels the others as soon as one fails and waits for them to stop"""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+async def download_chapter_files(chapter: Dict, job: Dict[str, Any]) -> int:
+    """Download every page of a chapter concurrently and mark it completed"""
+    chapter_dir = chapter_download_dir(chapter)
+    archive = chapter_archive_path(chapter)
+    # The page directory in directory mode, the CBZ otherwise
+    stored = chapter.get("download_path") or archive
+    if chapter.get("download_status") == "completed" and os.path.exists(stored):
+        job["completed_chapters"] += 1
+        return chapter.get("size", 0)
+
+    os.makedirs(chapter_dir, exist_ok=True)
+    await db.chapters.update_one(
+        {"id": chapter["id"]},
+        touch({"$set": {"download_status": "downloading", "download_path": chapter_dir}})
+    )
+    invalidate_chapter(chapter)
+
+    dedup = new_dedup_delta() if PAGE_DEDUP and STORAGE_MODE == "directory" else None
+    try:
+        # A failed page stops its siblings, so a retry never resumes .part files still being written
+        sizes = await gather_or_cancel(
+            download_page(url, os.path.join(chapter_dir, page_filename(i, url)), job, dedup)
+            for i, url in enumerate(iter_page_urls(chapter.get("pages")))
+        )
+    finally:
+        # Failures leave the chapter "downloading": the worker marks it failed once it stops retrying
+        if dedup:
+            await record_dedup_delta(dedup)
+
+    size = sum(sizes)
+    download_path = chapter_dir
+    if STORAGE_MODE == "cbz":
+        names = [page_filename(i, url) for i, url in enumerate(iter_page_urls(chapter.get("pages")))]
+        size = await asyncio.get_running_loop().run_in_executor(None, pack_chapter_archive, chapter_dir, archive, names)
+        archive_indexes.pop(archive, None)
+        download_path = archive
+
+    await db.chapters.update_one(
+        {"id": chapter["id"]},
+        touch({"$set": {"download_status": "completed", "download_path": download_path, "size": size}})
+    )
+    invalidate_chapter(chapter)
+    await ledger_record_chapter(chapter, size)
+    job["completed_chapters"] += 1
+    if VARIANT_PREGENERATE:
+        spawn_background(pregenerate_chapter_variants(chapter))
+    return size
+
+async def refresh_manga_download_status(manga_id: str):
+    """Roll chapter download states up into the manga document"""
+    total = await db.chapters.count_documents({"manga_id": manga_id})
+    stored = await ledger_totals(manga_id)
+    completed = stored["chapters"]
+    status = "completed" if total and completed >= total else ("downloading" if completed else "not_downloaded")
+    await db.manga.update_one(
+        {"id": manga_id, "$or": [{"download_status": {"$ne": status}}, {"total_size": {"$ne": stored["bytes"]}}]},
+        touch({"$set": {"download_status": status, "total_size": stored["bytes"]}})
+    )
+    response_cache.invalidate(f"manga:{manga_id}")
+    catalog_index.update_summary(manga_id, download_status=status)
+
+async def enqueue_download_job(kind: str, target_id: str, manga_id: str, chapters: List[Dict],
+                               priority: int) -> Dict[str, Any]:
+    """Record a download job and queue one task per chapter
+
+    A chapter that is already queued or leased is not queued twice; its task
+    only inherits the higher priority, and the new job does not count it.
+    Active tasks carry active=true under a unique partial index on chapter_id,
+    so concurrent enqueues from several API workers can't both insert one.
+    """
+    now = datetime.now()
+    job = {
+        "id": uuid.uuid4().hex,
+        "type": kind,
+        "target_id": target_id,
+        "manga_id": manga_id,
+        "priority": priority,
+        "status": "queued",
+        "total_chapters": len(chapters),
+        "completed_chapters": 0,
+        "failed_chapters": 0,
+        **{counter: 0 for counter in DOWNLOAD_JOB_COUNTERS},
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "error": None,
+    }
+    await db.download_jobs.insert_one(dict(job))
+
+    if chapters:
+        ops = [
+            UpdateOne(
+                {"chapter_id": chapter["id"], "active": True},
+                {
+                    "$setOnInsert": {
+                        "id": uuid.uuid4().hex, "job_id": job["id"], "chapter_id": chapter["id"],
+                        "manga_id": manga_id, "chapter_number": chapter.get("chapter_number"),
+                        "status": "queued", "attempts": 0, "available_at": now,
+                        "lease_owner": None, "lease_expires_at": None, "last_error": None, "created_at": now,
+                    },
+                    "$max": {"priority": priority},
+                },
+                upsert=True,
+            )
+            for chapter in chapters
+        ]
+        upserted = 0
+        for attempt in range(2):
+            try:
+                upserted += (await db.download_queue.bulk_write(ops, ordered=False)).upserted_count
+                break
+            except BulkWriteError as e:
+                # Lost an insert race to another worker; retrying matches its task and applies the priority
+                errors = e.details["writeErrors"]
+                conflicts = [error["index"] for error in errors if error["code"] == 11000]
+                if attempt or len(conflicts) < len(errors):
+                    raise
+                upserted += e.details["nUpserted"]
+                ops = [ops[index] for index in conflicts]
+        already_queued = len(chapters) - upserted
+        if already_queued:
+            await db.download_jobs.update_one({"id": job["id"]}, {"$inc": {"total_chapters": -already_queued}})
+            job["total_chapters"] -= already_queued
+    await finish_download_job_if_done(job["id"])
+    download_worker.notify()
+    return job
+
+async def finish_download_job_if_done(job_id: str):
+    """Close a job once every one of its chapters completed or failed for good"""
+    now = datetime.now()
+    result = await db.download_jobs.update_one(
+        {
+            "id": job_id,
+            "status": {"$in": ["queued", "downloading"]},
+            "$expr": {"$gte": [{"$add": ["$completed_chapters", "$failed_chapters"]}, "$total_chapters"]},
+        },
+        [{"$set": {
+            "status": {"$cond": [{"$gt": ["$failed_chapters", 0]}, "failed", "completed"]},
+            "started_at": {"$ifNull": ["$started_at", now]},
+            "finished_at": now,
+        }}]
+    )
+    if result.modified_count:
+        job = await db.download_jobs.find_one({"id": job_id}, {"_id": 0, "manga_id": 1})
+        await refresh_manga_download_status(job["manga_id"])
+
+def download_retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for a failed chapter"""
+    return min(DOWNLOAD_RETRY_BASE * 2 ** max(attempts - 1, 0), DOWNLOAD_RETRY_MAX) * random.uniform(0.8, 1.2)
+
+class DownloadWorker:
+    """Leases chapter tasks from db.download_queue and downloads them
+
+    Any number of processes can run a worker against the same database: a
+    task is claimed with one find_one_and_update, kept alive by heartbeats
+    that extend its lease, and picked up again by another worker once the
+    lease expires. Failed chapters are retried with backoff until
+    DOWNLOAD_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, slots: int):
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.slots = slots
+        self.active: Dict[str, Dict[str, Any]] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.counters = {"claimed": 0, "reclaimed_expired": 0, "completed": 0, "retried": 0, "failed": 0, "lease_lost": 0}
+
+    def notify(self):
+        """Wake idle slots after work was queued by this process"""
+        self.wakeup.set()
+
+    def start(self):
+        self.task = spawn_background(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        await asyncio.gather(*[self.slot_loop() for _ in range(self.slots)])
+
+    async def slot_loop(self):
+        while True:
+            try:
+                task = await self.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Download queue claim failed: %s", e)
+                task = None
+            if task is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), DOWNLOAD_QUEUE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(task)
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically lease the most urgent ready task, or one whose lease expired"""
+        now = datetime.now()
+        lease = {"status": "leased", "lease_owner": self.id, "heartbeat_at": now,
+                 "lease_expires_at": datetime.fromtimestamp(now.timestamp() + DOWNLOAD_LEASE_SECONDS)}
+        previous = await db.download_queue.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "available_at": {"$lte": now}},
+                {"status": "leased", "lease_expires_at": {"$lt": now}},
+            ]},
+            {"$set": lease, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            sort=[("priority", DESCENDING), ("available_at", ASCENDING)],
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is None:
+            return None
+        self.counters["claimed"] += 1
+        if previous["status"] == "leased":
+            self.counters["reclaimed_expired"] += 1
+            logger.info("Reclaimed download task %s from %s", previous["id"], previous["lease_owner"])
+        return {**previous, **lease, "attempts": previous["attempts"] + 1}
+
+    def owned(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": task["id"], "lease_owner": self.id}
+
+    async def flush_counters(self, task: Dict[str, Any], counters: Dict[str, Any], flushed: Dict[str, int], **extra):
+        """Add progress made since the last flush to the job document"""
+        delta = {counter: counters[counter] - flushed.get(counter, 0) for counter in DOWNLOAD_JOB_COUNTERS}
+        flushed.update({counter: counters[counter] for counter in DOWNLOAD_JOB_COUNTERS})
+        inc = {k: v for k, v in {**delta, **extra}.items() if v}
+        if inc:
+            await db.download_jobs.update_one({"id": task["job_id"]}, {"$inc": inc})
+
+    async def heartbeat(self, task: Dict[str, Any], counters: Dict[str, Any], flushed: Dict[str, int]) -> bool:
+        """Extend the lease; False when another worker has taken the task over"""
+        now = datetime.now()
+        result = await db.download_queue.update_one(self.owned(task), {"$set": {
+            "heartbeat_at": now,
+            "lease_expires_at": datetime.fromtimestamp(now.timestamp() + DOWNLOAD_LEASE_SECONDS),
+        }})
+        if not result.matched_count:
+            return False
+        await self.flush_counters(task, counters, flushed)
+        return True
+
+    async def execute(self, task: Dict[str, Any], counters: Dict[str, Any]):
+        chapter = await db.chapters.find_one({"id": task["chapter_id"]}, {"_id": 0})
+        if not chapter:
+            raise LookupError(f"Chapter {task['chapter_id']} no longer exists")
+        await download_chapter_files(chapter, counters)
+
+    async def process(self, task: Dict[str, Any]):
+        counters = new_download_counters()
+        flushed: Dict[str, int] = {}
+        self.active[task["id"]] = counters
+        work = None
+        try:
+            await db.download_jobs.update_one(
+                {"id": task["job_id"], "status": "queued"},
+                {"$set": {"status": "downloading", "started_at": datetime.now()}}
+            )
+            if task["attempts"] > DOWNLOAD_MAX_ATTEMPTS:
+                # Leased so often without finishing that workers keep dying on it
+                await self.fail(task, counters, flushed, "Lease expired too many times", permanent=True)
+                return
+            work = asyncio.create_task(self.execute(task, counters))
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=DOWNLOAD_HEARTBEAT_INTERVAL)
+                if done:
+                    break
+                if not await self.heartbeat(task, counters, flushed):
+                    self.counters["lease_lost"] += 1
+                    logger.warning("Lost lease on download task %s", task["id"])
+                    work.cancel()
+                    return
+            error = work.exception()
+            if error is None:
+                await self.complete(task, counters, flushed)
+            else:
+                await self.fail(task, counters, flushed, str(error) or error.__class__.__name__,
+                                permanent=isinstance(error, LookupError))
+        except asyncio.CancelledError:
+            # Shutting down: hand the task straight back instead of waiting for the lease to expire
+            if work is not None:
+                work.cancel()
+            await asyncio.shield(self.release(task))
+            raise
+        except Exception as e:
+            logger.warning("Download task %s bookkeeping failed: %s", task["id"], e)
+        finally:
+            counters["finished_at"] = datetime.now()
+            self.active.pop(task["id"], None)
+
+    async def complete(self, task: Dict[str, Any], counters: Dict[str, Any], flushed: Dict[str, int]):
+        result = await db.download_queue.update_one(self.owned(task), {"$set": {
+            "status": "completed", "active": False, "finished_at": datetime.now(),
+            "lease_owner": None, "lease_expires_at": None,
+        }})
+        if not result.matched_count:
+            self.counters["lease_lost"] += 1
+            return
+        self.counters["completed"] += 1
+        await self.flush_counters(task, counters, flushed, completed_chapters=1)
+        await finish_download_job_if_done(task["job_id"])
+
+    async def fail(self, task: Dict[str, Any], counters: Dict[str, Any], flushed: Dict[str, int], error: str,
+                   permanent: bool = False):
+        final = permanent or task["attempts"] >= DOWNLOAD_MAX_ATTEMPTS
+        update = {"last_error": error, "lease_owner": None, "lease_expires_at": None}
+        if final:
+            update.update(status="failed", active=False, finished_at=datetime.now())
+        else:
+            update.update(status="queued",
+                          available_at=datetime.fromtimestamp(time.time() + download_retry_delay(task["attempts"])))
+        result = await db.download_queue.update_one(self.owned(task), {"$set": update})
+        if not result.matched_count:
+            self.counters["lease_lost"] += 1
+            return
+        if not final:
+            self.counters["retried"] += 1
+            await self.flush_counters(task, counters, flushed)
+            return
+        self.counters["failed"] += 1
+        chapter = await db.chapters.find_one_and_update(
+            {"id": task["chapter_id"], "download_status": "downloading"},
+            touch({"$set": {"download_status": "failed"}}),
+            projection={"_id": 0, "id": 1, "manga_id": 1}
+        )
+        if chapter:
+            invalidate_chapter(chapter)
+        await self.flush_counters(task, counters, flushed, failed_chapters=1)
+        await db.download_jobs.update_one({"id": task["job_id"]}, {"$set": {"error": error}})
+        await finish_download_job_if_done(task["job_id"])
+
+    async def release(self, task: Dict[str, Any]):
+        try:
+            await db.download_queue.update_one(self.owned(task), {
+                "$set": {"status": "queued", "available_at": datetime.now(), "lease_owner": None, "lease_expires_at": None},
+                "$inc": {"attempts": -1},
+            })
+        except Exception as e:
+            logger.warning("Could not release download task %s: %s", task["id"], e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "worker_id": self.id, "enabled": self.task is not None,
+                "slots": self.slots, "active": len(self.active)}
+
+download_worker = DownloadWorker(DOWNLOAD_CHAPTER_CONCURRENCY)
+
+async def download_queue_stats() -> Dict[str, Any]:
+    """Task counts by status across all workers"""
+    counts = {"queued": 0, "leased": 0, "completed": 0, "failed": 0}
+    async for row in db.download_queue.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    return {"tasks": counts, "worker": download_worker.stats()}
+
+# CBZ chapter archives
+archive_indexes: "OrderedDict[str, tuple]" = OrderedDict()
+
+def chapter_archive_path(chapter: Dict) -> str:
+    return chapter_download_dir(chapter) + ".cbz"
+
+def pack_chapter_archive(chapter_dir: str, archive: str, names: List[str]) -> int:
+    """Pack downloaded pages into a stored (uncompressed) CBZ and drop the loose files"""
+    tmp = f"{archive}.{uuid.uuid4().hex}.tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as zf:
+        for name in names:
+            zf.write(os.path.join(chapter_dir, name), name)
+    os.replace(tmp, archive)
+    for name in names:
+        os.remove(os.path.join(chapter_dir, name))
+    try:
+        os.rmdir(chapter_dir)
+    except OSError:
+        pass  # still holds page variants
+    return os.path.getsize(archive)
+
+def read_archive_index(archive: str) -> Dict[str, tuple]:
+    """Map each stored member of a CBZ to (data offset, size)"""
+    index = {}
+    with open(archive, "rb") as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                continue
+            # The local header's extra field can differ from the central directory's
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            index[info.filename] = (info.header_offset + 30 + name_length + extra_length, info.file_size)
+    return index
+
+async def archive_index(archive: str) -> Dict[str, tuple]:
+    """Central-directory index of an archive, cached until the file changes"""
+    mtime = os.stat(archive).st_mtime_ns
+    cached = archive_indexes.get(archive)
+    if cached and cached[0] == mtime:
+        archive_indexes.move_to_end(archive)
+        return cached[1]
+    index = await asyncio.get_running_loop().run_in_executor(None, read_archive_index, archive)
+    archive_indexes[archive] = (mtime, index)
+    while len(archive_indexes) > ARCHIVE_INDEX_CACHE_SIZE:
+        archive_indexes.popitem(last=False)
+    return index
+
+archive_export_pool: Optional[ThreadPoolExecutor] = None
+archive_export_slots = asyncio.Semaphore(ARCHIVE_EXPORT_WORKERS)
+
+def get_archive_export_pool() -> ThreadPoolExecutor:
+    global archive_export_pool
+    if archive_export_pool is None:
+        archive_export_pool = ThreadPoolExecutor(max_workers=ARCHIVE_EXPORT_WORKERS, thread_name_prefix="zip-export")
+    return archive_export_pool
+
+def dos_datetime(mtime: float) -> tuple:
+    t = time.localtime(max(mtime, 315532800))  # ZIP dates start in 1980
+    return t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2, (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+
+def zip_central_entry(member: Dict[str, Any], crc: int) -> bytes:
+    size, offset = member["size"], member["offset"]
+    extra = b""
+    if member["zip64"]:
+        extra += struct.pack("<QQ", size, size)
+    if offset > zipfile.ZIP64_LIMIT:
+        extra += struct.pack("<Q", offset)
+    if extra:
+        extra = struct.pack("<HH", 1, len(extra)) + extra
+    size_field = 0xFFFFFFFF if member["zip64"] else size
+    return struct.pack(
+        "<4s4B4HL2L5H2L", b"PK\x01\x02", member["version"], 3, member["version"], 0, member["flags"], zipfile.ZIP_STORED,
+        member["time"], member["date"], crc, size_field, size_field, len(member["name"]), len(extra), 0, 0, 0,
+        (member["mode"] & 0xFFFF) << 16, min(offset, 0xFFFFFFFF)
+    ) + member["name"] + extra
+
+def zip_end_records(count: int, central_offset: int, central_size: int) -> bytes:
+    records = b""
+    if count > zipfile.ZIP_FILECOUNT_LIMIT or central_offset > zipfile.ZIP64_LIMIT or central_size > zipfile.ZIP64_LIMIT:
+        end64_offset = central_offset + central_size
+        records += struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, central_size, central_offset)
+        records += struct.pack("<4sLQL", b"PK\x06\x07", 0, end64_offset, 1)
+    return records + struct.pack(
+        "<4s4H2LH", b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+        min(central_size, 0xFFFFFFFF), min(central_offset, 0xFFFFFFFF), 0
+    )
+
+def build_zip_layout(entries: List[tuple]) -> Dict[str, Any]:
+    """Lay out a stored ZIP of (arcname, path) entries from their stats alone
+
+    CRCs go into data descriptors written after each member, so every header
+    and offset, and the archive's total size, are known before streaming.
+    """
+    members = []
+    offset = 0
+    for arcname, path in entries:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # evicted since the entries were listed
+        try:
+            name, flags = arcname.encode("ascii"), 0x08
+        except UnicodeEncodeError:
+            name, flags = arcname.encode("utf-8"), 0x808
+        zip64 = stat.st_size > zipfile.ZIP64_LIMIT
+        version = 45 if zip64 else 20
+        dostime, dosdate = dos_datetime(stat.st_mtime)
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+        size_field = 0xFFFFFFFF if zip64 else 0
+        header = struct.pack(
+            "<4s2B4HL2L2H", b"PK\x03\x04", version, 0, flags, zipfile.ZIP_STORED, dostime, dosdate,
+            0, size_field, size_field, len(name), len(extra)
+        ) + name + extra
+        member = {"path": path, "size": stat.st_size, "offset": offset, "header": header, "name": name,
+                  "flags": flags, "version": version, "time": dostime, "date": dosdate, "mode": stat.st_mode,
+                  "zip64": zip64}
+        members.append(member)
+        offset += len(header) + stat.st_size + (24 if zip64 else 16)
+    central_size = sum(len(zip_central_entry(member, 0)) for member in members)
+    end = zip_end_records(len(members), offset, central_size)
+    return {"members": members, "end": end, "size": offset + central_size + len(end)}
+
+def read_zip_slice(fd: int, length: int, position: int, crc: int) -> tuple:
+    chunk = os.pread(fd, length, position)
+    return chunk, zlib.crc32(chunk, crc)
+
+async def iter_zip_stream(layout: Dict[str, Any]):
+    """Stream a stored ZIP laid out by build_zip_layout
+
+    Headers come from the layout and each member is sent as slices of its
+    file, read and checksummed on the export pool; the response's own
+    backpressure bounds memory to one slice. Exports beyond
+    ARCHIVE_EXPORT_WORKERS wait for a slot.
+    """
+    async with archive_export_slots:
+        loop = asyncio.get_running_loop()
+        pool = get_archive_export_pool()
+        crcs = []
+        for member in layout["members"]:
+            yield member["header"]
+            fd = await loop.run_in_executor(pool, os.open, member["path"], os.O_RDONLY)
+            try:
+                crc = position = 0
+                while position < member["size"]:
+                    length = min(1024 * 1024, member["size"] - position)
+                    chunk, crc = await loop.run_in_executor(pool, read_zip_slice, fd, length, position, crc)
+                    if not chunk:
+                        raise OSError(f"{member['path']} shrank during export")
+                    position += len(chunk)
+                    yield chunk
+            finally:
+                os.close(fd)
+            crcs.append(crc)
+            descriptor = "<4sLQQ" if member["zip64"] else "<4sLLL"
+            yield struct.pack(descriptor, b"PK\x07\x08", crc, member["size"], member["size"])
+        yield b"".join(zip_central_entry(member, crc) for member, crc in zip(layout["members"], crcs)) + layout["end"]
+
+async def zip_stream_response(entries: List[tuple], media_type: str, filename: str) -> StreamingResponse:
+    layout = await asyncio.get_running_loop().run_in_executor(None, build_zip_layout, entries)
+    return StreamingResponse(
+        iter_zip_stream(layout), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Content-Length": str(layout["size"])}
+    )
+
+async def chapter_archive_entries(chapter: Dict, prefix: str = "") -> List[tuple]:
+    """(arcname, path) entries for a downloaded chapter"""
+    archive = chapter_archive_path(chapter)
+    if os.path.exists(archive):
+        return [(f"{prefix}{os.path.basename(archive)}", archive)]
+    chapter_dir = chapter.get("download_path") or chapter_download_dir(chapter)
+    entries = []
+    for index, url in enumerate(iter_page_urls(chapter.get("pages"))):
+        path = os.path.join(chapter_dir, page_filename(index, url))
+        if os.path.exists(path):
+            entries.append((f"{prefix}chapter_{chapter['chapter_number']}/{page_filename(index, url)}", path))
+    return entries
+
+# File serving with ETag and Range support
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=start-end' range; None means serve the whole file"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def iter_file_range(path: str, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates
+
+def serve_file(request: Request, path: str, etag: str, media_type: str, max_age: int = PAGE_CACHE_MAX_AGE,
+               offset: int = 0, length: Optional[int] = None) -> Response:
+    """Serve a file, or a byte slice of one, with a strong ETag, Cache-Control and single-range support"""
+    size = os.path.getsize(path) if length is None else length
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={max_age}",
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == f'"{etag}"'):
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                iter_file_range(path, offset + start, end - start + 1), status_code=206, media_type=media_type, headers=headers
+            )
+
+    if length is not None:
+        # A member of an archive: read just its bytes
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file_range(path, offset, size), media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+# Page cache
+class PageCache:
+    """On-disk cache of remote page images keyed by the SHA-256 of their URL
+
+    Each object is stored next to a small JSON sidecar holding its content
+    digest (used as a strong ETag) and content type. Objects are evicted in
+    least-recently-used order once the cache exceeds its byte budget.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def load_index(self):
+        """Rebuild the in-memory index from disk, oldest access first"""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(dirpath, name)
+                data_path = meta_path[:-len(".json")]
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    found.append((os.stat(data_path).st_atime, os.path.basename(data_path), meta))
+                except (OSError, ValueError):
+                    continue
+        for _, key, meta in sorted(found, key=lambda item: item[0]):
+            self.entries[key] = meta
+            self.total_bytes += meta["size"]
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        key = self.key_for(url)
+        meta = self.entries.get(key)
+        if meta is None or not os.path.exists(self.path_for(key)):
+            return None
+        self.entries.move_to_end(key)
+        return {**meta, "path": self.path_for(key)}
+
+    async def fetch(self, url: str) -> Dict[str, Any]:
+        """Return a cached page, fetching it once even under concurrent requests"""
+        cached = self.get(url)
+        if cached:
+            self.counters["hits"] += 1
+            return cached
+        key = self.key_for(url)
+        task = self.inflight.get(key)
+        if task:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["misses"] += 1
+            task = asyncio.create_task(self.store(url, key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def store(self, url: str, key: str) -> Dict[str, Any]:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        started = time.monotonic()
+        try:
+            async with get_http_session().get(url) as response:
+                if response.status >= 400:
+                    observe_outbound(urlparse(url).netloc, "page", started, failed=True)
+                    raise HTTPException(status_code=502, detail=f"Upstream returned {response.status}")
+                content_type = response.headers.get("Content-Type", "application/octet-stream")
+                async with aiofiles.open(tmp, "wb") as f:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        await f.write(chunk)
+            os.replace(tmp, path)
+            observe_outbound(urlparse(url).netloc, "page", started)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            observe_outbound(urlparse(url).netloc, "page", started, failed=True)
+            raise HTTPException(status_code=502, detail=f"Upstream fetch failed: {e}")
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        meta = {"url": url, "etag": digest.hexdigest(), "size": size, "content_type": content_type}
+        async with aiofiles.open(f"{path}.json", "w") as f:
+            await f.write(json.dumps(meta))
+
+        if key in self.entries:
+            self.total_bytes -= self.entries[key]["size"]
+        self.entries[key] = meta
+        self.total_bytes += size
+        self.evict()
+        return {**meta, "path": path}
+
+    async def variant(self, source: Dict[str, Any], width: Optional[int], fmt: str) -> Dict[str, Any]:
+        """Cached resized/re-encoded copy of a cached page"""
+        url = f"{source['url']}#w={width or 'full'}&fmt={fmt}"
+        cached = self.get(url)
+        if cached:
+            self.counters["hits"] += 1
+            return cached
+        key = self.key_for(url)
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(await ensure_variant((source["path"], 0, None), path, width, fmt))
+        meta = {
+            "url": url,
+            "etag": hashlib.sha256(f"{source['etag']}:{width}:{fmt}".encode()).hexdigest(),
+            "size": size,
+            "content_type": VARIANT_FORMATS[fmt][1],
+        }
+        async with aiofiles.open(f"{path}.json", "w") as f:
+            await f.write(json.dumps(meta))
+        if key not in self.entries:
+            self.total_bytes += size
+        self.entries[key] = meta
+        self.evict()
+        return {**meta, "path": path}
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, meta = self.entries.popitem(last=False)
+            self.total_bytes -= meta["size"]
+            self.counters["evictions"] += 1
+            for path in (self.path_for(key), f"{self.path_for(key)}.json"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "entries": len(self.entries),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self.inflight),
+        }
+
+page_cache = PageCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES)
+
+async def chapter_page_url(chapter_id: str, index: int) -> tuple:
+    """Look up (chapter, page URL) for a page index"""
+    chapter = await db.chapters.find_one(
+        {"id": chapter_id},
+        {"_id": 0, "id": 1, "manga_id": 1, "chapter_number": 1, "pages": 1, "download_status": 1, "download_path": 1}
+    )
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    pages = chapter.get("pages")
+    if index < 0 or index >= page_count(pages):
+        raise HTTPException(status_code=404, detail="Page not found")
+    return chapter, page_url(pages, index)
+
+def downloaded_page_path(chapter: Dict, index: int, url: str) -> Optional[str]:
+    """Local file of a page if its chapter has been downloaded"""
+    if chapter.get("download_status") != "completed":
+        return None
+    path = os.path.join(chapter.get("download_path") or chapter_download_dir(chapter), page_filename(index, url))
+    return path if os.path.exists(path) else None
+
+# Page variants
+transcode_pool: Optional[ProcessPoolExecutor] = None
+variant_inflight: Dict[str, asyncio.Task] = {}
+
+def get_transcode_pool() -> ProcessPoolExecutor:
+    global transcode_pool
+    if transcode_pool is None:
+        transcode_pool = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS)
+    return transcode_pool
+
+def available_variant_formats() -> List[str]:
+    if Image is None:
+        return []
+    return [name for name, (pil_format, _) in VARIANT_FORMATS.items() if pil_format in Image.SAVE]
+
+def variant_width(requested: Optional[int]) -> Optional[int]:
+    """Snap a requested width to the nearest allowed width that is not smaller"""
+    if requested is None:
+        return None
+    if requested <= 0:
+        raise HTTPException(status_code=400, detail="w must be positive")
+    return next((w for w in VARIANT_WIDTHS if w >= requested), VARIANT_WIDTHS[-1])
+
+def transcode_image(src: tuple, dest: str, width: Optional[int], pil_format: str, quality: int) -> int:
+    """Resize and re-encode one image; runs in the transcode process pool
+
+    src is (path, offset, length); length is None for a plain file and set for
+    a page stored inside a CBZ archive.
+    """
+    path, offset, length = src
+    if length is None:
+        source = path
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            source = io.BytesIO(f.read(length))
+    with Image.open(source) as image:
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if width and image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        image.save(tmp, pil_format, quality=quality)
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+def variant_name(index: int, width: Optional[int], fmt: str) -> str:
+    return f"page_{index:04d}_w{width or 'full'}.{fmt}"
+
+async def ensure_variant(src: tuple, dest: str, width: Optional[int], fmt: str) -> str:
+    """Create a variant file once, even when several readers ask for it together"""
+    if os.path.exists(dest):
+        return dest
+    task = variant_inflight.get(dest)
+    if task is None:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(
+            get_transcode_pool(), transcode_image, src, dest, width, VARIANT_FORMATS[fmt][0], VARIANT_QUALITY
+        ))
+        variant_inflight[dest] = task
+        task.add_done_callback(lambda _: variant_inflight.pop(dest, None))
+    await asyncio.shield(task)
+    return dest
+
+async def pregenerate_chapter_variants(chapter: Dict):
+    """Build the configured variants of a freshly downloaded chapter"""
+    formats = available_variant_formats()
+    chapter = {**chapter, "download_status": "completed"}
+    for index, url in enumerate(iter_page_urls(chapter.get("pages"))):
+        source = await local_page_source(chapter, index, url)
+        if not source:
+            continue
+        for width, fmt in VARIANT_PREGENERATE:
+            if fmt not in formats:
+                continue
+            name = variant_name(index, width, fmt)
+            try:
+                await ensure_variant(source["src"], os.path.join(source["variants_dir"], name), width, fmt)
+            except Exception as e:
+                logger.warning("Variant %s of chapter %s failed: %s", name, chapter["id"], e)
+
+def local_file_etag(path: str) -> str:
+    stat = os.stat(path)
+    return hashlib.sha256(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+async def local_page_source(chapter: Dict, index: int, url: str) -> Optional[Dict[str, Any]]:
+    """Where a downloaded page lives: a loose file or a member of the chapter CBZ"""
+    if chapter.get("download_status") != "completed":
+        return None
+    name = page_filename(index, url)
+    variants_dir = os.path.join(chapter_download_dir(chapter), "variants")
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    path = downloaded_page_path(chapter, index, url)
+    if path:
+        return {"src": (path, 0, None), "etag": local_file_etag(path), "media_type": media_type, "variants_dir": variants_dir}
+
+    archive = chapter_archive_path(chapter)
+    if os.path.exists(archive):
+        entry = (await archive_index(archive)).get(name)
+        if entry:
+            etag = hashlib.sha256(f"{local_file_etag(archive)}:{name}".encode()).hexdigest()
+            return {"src": (archive, entry[0], entry[1]), "etag": etag, "media_type": media_type, "variants_dir": variants_dir}
+    return None
+
+# Response cache
+class ResponseCache:
+    """Serialized JSON bodies with ETags, invalidated by tag on writes
+
+    Each entry is tagged with what it was built from (e.g. "sources",
+    "manga:<id>", "chapter:<id>"). Writers call invalidate() with the same tags.
+    A per-tag version guards against caching a body that was built while a
+    write to one of its tags was in progress.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.tag_keys: Dict[str, set] = {}
+        self.versions: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "evictions": 0}
 
-app = FastAPI(title="Manga Slayer API", version="1.0.0")
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > self.ttl:
+            self.drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    def snapshot(self, tags: List[str]) -> tuple:
+        return tuple(self.versions.get(tag, 0) for tag in tags)
 
-# Create downloads directory
-DOWNLOADS_DIR = "/app/downloads"
-os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    def put(self, key: str, tags: List[str], versions: tuple, body: bytes, etag: str):
+        if self.snapshot(tags) != versions:
+            return  # invalidated while the body was being built
+        self.drop(key)
+        self.entries[key] = {"body": body, "etag": etag, "tags": tags, "stored_at": time.time()}
+        self.total_bytes += len(body)
+        for tag in tags:
+            self.tag_keys.setdefault(tag, set()).add(key)
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self.drop(next(iter(self.entries)))
+            self.counters["evictions"] += 1
 
-# Pydantic models
-class MangaSource(BaseModel):
-    id: str
-    name: str
-    url: str
-    type: str = "custom"  # built-in or custom
-    enabled: bool = True
-    added_date: datetime = None
+    def drop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= len(entry["body"])
+        for tag in entry["tags"]:
+            keys = self.tag_keys.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_keys[tag]
 
-class MangaInfo(BaseModel):
-    id: str
-    title: str
-    title_ar: str = ""
-    description: str = ""
-    description_ar: str = ""
-    cover_image: str = ""
-    source: str
-    chapters: List[Dict] = []
-    total_size: int = 0  # in bytes
-    download_status: str = "not_downloaded"  # not_downloaded, downloading, completed
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+            for key in list(self.tag_keys.get(tag, ())):
+                self.drop(key)
+        self.counters["invalidations"] += len(tags)
 
-class ChapterInfo(BaseModel):
-    id: str
-    manga_id: str
-    chapter_number: float
-    title: str
-    title_ar: str = ""
-    pages: List[str] = []
-    size: int = 0  # in bytes
-    download_status: str = "not_downloaded"
-    download_path: str = ""
+    def clear(self):
+        for tag in list(self.tag_keys):
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+        self.entries.clear()
+        self.tag_keys.clear()
+        self.total_bytes = 0
+        self.counters["invalidations"] += 1
 
-class DownloadStats(BaseModel):
-    total_manga: int
-    total_chapters: int
-    total_size: int
-    available_space: int
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "entries": len(self.entries),
+            "total_bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
 
-class AutoScrollSettings(BaseModel):
-    speed: int = 3  # 1-10 scale
-    enabled: bool = False
-    pause_on_tap: bool = True
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
 
-class UserPreferences(BaseModel):
-    auto_scroll: AutoScrollSettings = AutoScrollSettings()
-    language: str = "ar"
-    reading_direction: str = "rtl"
-    auto_translate: bool = True
+def invalidate_chapter(chapter: Dict):
+    """Drop cached responses that embed a chapter"""
+    response_cache.invalidate(f"chapter:{chapter['id']}", f"manga:{chapter['manga_id']}")
 
-# Built-in manga sources
-BUILT_IN_SOURCES = [
-    {
-        "id": "mangadex",
-        "name": "MangaDex",
-        "url": "https://api.mangadex.org",
-        "type": "built-in"
-    },
-    {
-        "id": "mangakakalot",
-        "name": "MangaKakalot",
-        "url": "https://mangakakalot.com",
-        "type": "built-in"
-    },
-    {
-        "id": "manganato",
-        "name": "Manganato", 
-        "url": "https://manganato.com",
-        "type": "built-in"
-    }
-]
+async def cached_json_response(request: Request, tags: List[str], build: Callable[[], Awaitable[Any]]) -> Response:
+    """Serve a JSON body from the response cache, answering If-None-Match with 304"""
+    key = f"{request.url.path}?{request.url.query}"
+    entry = response_cache.get(key)
+    if entry is None:
+        response_cache.counters["misses"] += 1
+        versions = response_cache.snapshot(tags)
+        content = await build()
+        body = dumps_json(content)
+        entry = {"body": body, "etag": hashlib.sha256(body).hexdigest()[:32]}
+        response_cache.put(key, tags, versions, body, entry["etag"])
+    else:
+        response_cache.counters["hits"] += 1
 
-# Translation service (placeholder for Google Translate API)
-async def translate_text(text: str, target_lang: str = "ar") -> str:
-    """Translate text to Arabic using Google Translate API"""
+    headers = {"ETag": f'"{entry["etag"]}"', "Cache-Control": "no-cache"}
+    if etag_matches(request, entry["etag"]):
+        response_cache.counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+# Next-chapter prefetch
+class ChapterPrefetcher:
+    """Warms the next chapters of a reader into the page cache
+
+    Prefetches run at low priority (a small shared page semaphore), are shared
+    by every reader heading to the same chapter, and are cancelled once no
+    reader is waiting for them any more.
+    """
+
+    def __init__(self, trigger_pages: int, chapters_ahead: int, concurrency: int):
+        self.trigger_pages = trigger_pages
+        self.chapters_ahead = chapters_ahead
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.readers: Dict[str, set] = {}  # chapter id -> readers waiting on it
+        self.targets: Dict[tuple, set] = {}  # reader -> chapter ids prefetched for it
+        self.chapter_meta: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.counters = {"scheduled": 0, "deduplicated": 0, "completed": 0, "cancelled": 0, "pages_warmed": 0}
+
+    async def get_chapter_meta(self, chapter_id: str) -> Optional[Dict[str, Any]]:
+        meta = self.chapter_meta.get(chapter_id)
+        if meta is None:
+            chapter = await db.chapters.find_one({"id": chapter_id}, {"_id": 0, "manga_id": 1, "chapter_number": 1, "pages": 1})
+            if not chapter:
+                return None
+            meta = {"manga_id": chapter["manga_id"], "chapter_number": chapter["chapter_number"],
+                    "page_count": page_count(chapter.get("pages"))}
+            self.chapter_meta[chapter_id] = meta
+            while len(self.chapter_meta) > CHAPTER_META_CACHE_SIZE:
+                self.chapter_meta.popitem(last=False)
+        self.chapter_meta.move_to_end(chapter_id)
+        return meta
+
+    async def observe(self, user: str, manga_id: str, chapter_id: str, page: int):
+        """React to a progress update; schedules prefetches near the end of a chapter"""
+        reader = (user, manga_id)
+        meta = await self.get_chapter_meta(chapter_id)
+        if not meta:
+            return
+        previous = self.targets.get(reader, set())
+        if meta["page_count"] - page > self.trigger_pages:
+            # Not near the end: keep only a prefetch of the chapter being read now
+            self.release(reader, previous - {chapter_id})
+            return
+
+        upcoming = await db.chapters.find(
+            {"manga_id": manga_id, "chapter_number": {"$gt": meta["chapter_number"]}},
+            {"_id": 0, "id": 1, "manga_id": 1, "chapter_number": 1, "pages": 1,
+             "download_status": 1, "download_path": 1}
+        ).sort("chapter_number", ASCENDING).limit(self.chapters_ahead).to_list(length=self.chapters_ahead)
+        wanted = {c["id"] for c in upcoming if c.get("download_status") != "completed"}
+        self.release(reader, previous - wanted - {chapter_id})
+        self.targets[reader] = (previous & {chapter_id}) | wanted
+        for chapter in upcoming:
+            if chapter["id"] in wanted:
+                self.schedule(reader, chapter)
+
+    def schedule(self, reader: tuple, chapter: Dict):
+        self.readers.setdefault(chapter["id"], set()).add(reader)
+        if chapter["id"] in self.tasks:
+            self.counters["deduplicated"] += 1
+            return
+        self.counters["scheduled"] += 1
+        task = spawn_background(self.warm(chapter))
+        self.tasks[chapter["id"]] = task
+        task.add_done_callback(lambda done: self.finished(chapter["id"], done))
+
+    async def warm(self, chapter: Dict):
+        async def warm_page(url: str):
+            async with self.semaphore:
+                try:
+                    await page_cache.fetch(url)
+                    self.counters["pages_warmed"] += 1
+                except HTTPException:
+                    pass
+        await asyncio.gather(*[warm_page(url) for url in iter_page_urls(chapter.get("pages"))])
+        self.counters["completed"] += 1
+
+    def finished(self, chapter_id: str, task: asyncio.Task):
+        if self.tasks.get(chapter_id) is not task:
+            return
+        del self.tasks[chapter_id]
+        for reader in self.readers.pop(chapter_id, set()):
+            targets = self.targets.get(reader)
+            if targets is not None:
+                targets.discard(chapter_id)
+                if not targets:
+                    del self.targets[reader]
+
+    def release(self, reader: tuple, chapter_ids: set):
+        """Drop a reader from prefetches; cancel the ones nobody waits for"""
+        for chapter_id in chapter_ids:
+            readers = self.readers.get(chapter_id)
+            if readers is None:
+                continue
+            readers.discard(reader)
+            if not readers and chapter_id in self.tasks:
+                self.tasks[chapter_id].cancel()
+                self.counters["cancelled"] += 1
+        if reader in self.targets:
+            self.targets[reader] -= chapter_ids
+            if not self.targets[reader]:
+                del self.targets[reader]
+
+    def leave(self, user: str, manga_id: str):
+        reader = (user, manga_id)
+        self.release(reader, set(self.targets.get(reader, set())))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "active": len(self.tasks), "readers": len(self.targets)}
+
+prefetcher = ChapterPrefetcher(PREFETCH_TRIGGER_PAGES, PREFETCH_CHAPTERS, PREFETCH_CONCURRENCY)
+
+async def observe_reading_progress(user: str, manga_id: str, chapter_id: str, page: int):
     try:
-        # This is a placeholder - in production you'd use Google Translate API
-        # For now, returning the original text with [AR] prefix
-        return f"[مترجم] {text}"
+        await prefetcher.observe(user, manga_id, chapter_id, page)
     except Exception as e:
-        return text
+        logger.warning("Prefetch for %s failed: %s", chapter_id, e)
 
-# Helper functions
-def calculate_directory_size(path: str) -> int:
-    """Calculate total size of directory in bytes"""
-    total_size = 0
+# Chapter listing
+CHAPTER_ORDER = [("chapter_number", ASCENDING), ("id", ASCENDING)]
+
+def chapters_after_query(manga_id: str, after: Optional[float], after_id: Optional[str]) -> Dict[str, Any]:
+    """Chapters past a (chapter_number, id) keyset cursor; releases may share a chapter number"""
+    query: Dict[str, Any] = {"manga_id": manga_id}
+    if after is not None and after_id is not None:
+        query["$or"] = [{"chapter_number": {"$gt": after}}, {"chapter_number": after, "id": {"$gt": after_id}}]
+    elif after is not None:
+        query["chapter_number"] = {"$gt": after}
+    return query
+
+async def find_chapter_page(manga_id: str, limit: int, after: Optional[float] = None, after_id: Optional[str] = None,
+                            include_pages: bool = False, compact: bool = False) -> Dict[str, Any]:
+    """Keyset page of chapters ordered by (chapter_number, id)"""
+    query = chapters_after_query(manga_id, after, after_id)
+    projection = {"_id": 0} if include_pages else CHAPTER_LIST_PROJECTION
+
+    # Fetch one extra row to learn whether another page exists
+    chapters = await db.chapters.find(query, projection).sort(CHAPTER_ORDER).limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(chapters) > limit
+    chapters = chapters[:limit]
+    if include_pages and not compact:
+        chapters = [expand_chapter_pages(chapter) for chapter in chapters]
+    return {
+        "chapters": chapters,
+        "has_more": has_more,
+        "next_after": chapters[-1]["chapter_number"] if has_more else None,
+        "next_after_id": chapters[-1]["id"] if has_more else None,
+    }
+
+def chapter_summary_pipeline(manga_ids: List[str]) -> List[Dict[str, Any]]:
+    """Per-manga chapter count, downloaded count and latest chapter
+
+    The sort sits right after the match so the planner can push both into
+    one (manga_id, chapter_number, id) index scan instead of sorting in
+    memory; pages are projected away after it.
+    """
+    return [
+        {"$match": {"manga_id": {"$in": manga_ids}}},
+        {"$sort": {"manga_id": 1, "chapter_number": 1, "id": 1}},
+        {"$project": CHAPTER_LIST_PROJECTION},
+        {"$group": {
+            "_id": "$manga_id",
+            "chapters_count": {"$sum": 1},
+            "downloaded_chapters": {"$sum": {"$cond": [{"$eq": ["$download_status", "completed"]}, 1, 0]}},
+            "latest_chapter": {"$last": "$$ROOT"},
+        }},
+    ]
+
+# Metrics gauges
+def download_throughput_gauges() -> Dict[tuple, float]:
+    active = [download_job_summary(counters) for counters in download_worker.active.values()]
+    return {
+        (("unit", "pages_per_second"),): sum(task["pages_per_second"] for task in active),
+        (("unit", "mb_per_second"),): sum(task["mb_per_second"] for task in active),
+    }
+
+metrics.gauge("download_tasks_active", "Chapter downloads leased by this worker",
+              lambda: {(): len(download_worker.active)})
+metrics.gauge("download_pages_in_flight", "Page downloads currently holding a slot",
+              lambda: {(): DOWNLOAD_MAX_CONCURRENCY - download_semaphore._value})
+metrics.gauge("download_throughput", "Combined throughput of this worker's chapter downloads", download_throughput_gauges)
+metrics.gauge("background_tasks", "Background tasks currently running", lambda: {(): len(background_tasks)})
+metrics.gauge("progress_buffer_pending", "Reading progress updates waiting to be flushed",
+              lambda: {(): len(progress_buffer.entries)})
+
+# Delta sync
+# Every write to a synced collection goes through touch(), which stamps
+# updated_at and bumps version; deletes leave a tombstone. /api/sync pages
+# through everything stamped after the client's token, ordered by
+# (updated_at, _id) so equal timestamps never stall a page boundary.
+SYNC_COLLECTIONS = [
+    # (collection, per-user, projection)
+    ("manga", False, None),
+    ("chapters", False, {"pages": 0}),
+    ("sources", False, None),
+    ("reading_progress", True, None),
+    ("preferences", True, None),
+    ("tombstones", False, None),
+]
+
+def touch(update: Dict[str, Any]) -> Dict[str, Any]:
+    """Add sync bookkeeping (updated_at, version) to an update document"""
+    return {
+        **update,
+        "$set": {**update.get("$set", {}), "updated_at": datetime.now()},
+        "$inc": {**update.get("$inc", {}), "version": 1},
+    }
+
+async def record_tombstone(collection: str, doc_id: str):
+    await db.tombstones.update_one(
+        {"collection": collection, "id": doc_id}, {"$set": {"updated_at": datetime.now()}}, upsert=True
+    )
+
+async def backfill_sync_fields():
+    """Stamp documents written before delta sync existed, or by other tools"""
+    now = datetime.now()
+    for collection, _, _ in SYNC_COLLECTIONS[:-1]:
+        try:
+            await db[collection].update_many(
+                {"updated_at": {"$exists": False}}, {"$set": {"updated_at": now, "version": 1}}
+            )
+        except Exception as e:
+            logger.warning("Could not backfill sync fields on %s: %s", collection, e)
+
+def to_millis(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+def from_millis(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000)
+
+def encode_sync_token(state: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> Dict[str, Any]:
     try:
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.exists(fp):
-                    total_size += os.path.getsize(fp)
-    except:
-        pass
-    return total_size
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        int(state["s"])
+        return state
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
 
-async def fetch_manga_from_source(source_url: str, search_query: str = "") -> List[Dict]:
-    """Fetch manga list from a source"""
+async def sync_changes(since: Optional[str], user: str, limit: int) -> Dict[str, Any]:
+    """One page of changes after a sync token"""
+    now = datetime.now()
+    state = decode_sync_token(since) if since else {"s": 0}
+    reset = bool(state["s"]) and state["s"] < to_millis(now) - SYNC_TOMBSTONE_TTL * 1000
+    if reset:
+        # Tombstones this old are gone; start over with a full sync
+        state = {"s": 0}
+    # A session is bounded by the time of its first page so later writes wait for the next sync
+    upto = state.get("u") or to_millis(now)
+    index, cursor_key = state.get("c", 0), state.get("k")
+
+    changes: Dict[str, List[Dict]] = {name: [] for name, _, _ in SYNC_COLLECTIONS[:-1]}
+    deleted: List[Dict[str, str]] = []
+    remaining = limit
+    while index < len(SYNC_COLLECTIONS) and remaining > 0:
+        name, per_user, projection = SYNC_COLLECTIONS[index]
+        window = {"$lte": from_millis(upto)}
+        if state["s"]:
+            window["$gt"] = from_millis(state["s"])
+        query: Dict[str, Any] = {"updated_at": window}
+        if per_user:
+            query["user"] = user
+        if cursor_key:
+            last = from_millis(cursor_key[0])
+            query["$or"] = [{"updated_at": {"$gt": last}}, {"updated_at": last, "_id": {"$gt": ObjectId(cursor_key[1])}}]
+        docs = await db[name].find(query, projection).sort(
+            [("updated_at", ASCENDING), ("_id", ASCENDING)]
+        ).limit(remaining + 1).to_list(length=remaining + 1)
+
+        more = len(docs) > remaining
+        docs = docs[:remaining]
+        remaining -= len(docs)
+        for doc in docs:
+            doc_id = doc.pop("_id")
+            if name == "tombstones":
+                deleted.append({"collection": doc["collection"], "id": doc["id"]})
+            else:
+                changes[name].append(doc)
+        if more:
+            cursor_key = [to_millis(docs[-1]["updated_at"]), str(doc_id)]
+            break
+        index, cursor_key = index + 1, None
+
+    has_more = index < len(SYNC_COLLECTIONS)
+    if has_more:
+        token = {"s": state["s"], "u": upto, "c": index, "k": cursor_key}
+    else:
+        token = {"s": max(upto - int(SYNC_OVERLAP * 1000), state["s"])}
+    return {
+        "token": encode_sync_token(token),
+        "has_more": has_more,
+        "reset": reset or not since,
+        "changes": changes,
+        "deleted": deleted,
+        "server_time": now,
+    }
+
+# MongoDB indexes
+INDEXES = {
+    "manga": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("download_status", ASCENDING)], name="download_status"),
+        IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "chapters": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("manga_id", ASCENDING), ("chapter_number", ASCENDING), ("id", ASCENDING)],
+                   name="manga_chapter_number_id"),
+        IndexModel([("download_status", ASCENDING)], name="download_status"),
+        IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "reading_progress": [
+        IndexModel([("user", ASCENDING), ("manga_id", ASCENDING)], name="user_manga_id_unique", unique=True),
+        IndexModel([("user", ASCENDING), ("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "sources": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("type", ASCENDING)], name="type"),
+        IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "preferences": [
+        IndexModel([("user", ASCENDING)], name="user_unique", unique=True),
+        IndexModel([("user", ASCENDING), ("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "download_queue": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("priority", DESCENDING), ("available_at", ASCENDING)], name="claim"),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="expired_leases"),
+        IndexModel([("chapter_id", ASCENDING)], name="chapter_active_unique", unique=True,
+                   partialFilterExpression={"active": True}),
+        IndexModel([("job_id", ASCENDING), ("status", ASCENDING)], name="job_status"),
+    ],
+    "download_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "tombstones": [
+        IndexModel([("collection", ASCENDING), ("id", ASCENDING)], name="collection_id_unique", unique=True),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl", expireAfterSeconds=SYNC_TOMBSTONE_TTL),
+        IndexModel([("updated_at", ASCENDING), ("_id", ASCENDING)], name="sync"),
+    ],
+    "search_cache": [
+        IndexModel([("source", ASCENDING), ("query", ASCENDING)], name="source_query_unique", unique=True),
+        IndexModel([("stored_at", ASCENDING)], name="stored_at_ttl",
+                   expireAfterSeconds=int(SEARCH_CACHE_TTL + SEARCH_CACHE_STALE_TTL)),
+    ],
+}
+
+# Queries on the request path that must be served by an index
+# Indexes replaced by a wider one; dropped on startup
+RETIRED_INDEXES = {
+    "chapters": ["manga_chapter_number"],
+    "download_queue": ["chapter_status"],
+}
+
+HOT_QUERIES = [
+    {"name": "manga by id", "collection": "manga", "filter": {"id": "x"}},
+    {"name": "manga batch", "collection": "manga", "filter": {"id": {"$in": ["x", "y"]}}},
+    {"name": "manga by download_status", "collection": "manga", "filter": {"download_status": {"$in": ["downloading", "completed"]}}},
+    {"name": "chapter by id", "collection": "chapters", "filter": {"id": "x"}},
+    {"name": "chapters of manga", "collection": "chapters", "filter": {"manga_id": "x"}, "sort": {"chapter_number": 1, "id": 1}},
+    {"name": "chapters after cursor", "collection": "chapters",
+     "filter": {"manga_id": "x", "$or": [{"chapter_number": {"$gt": 1}}, {"chapter_number": 1, "id": {"$gt": "x"}}]},
+     "sort": {"chapter_number": 1, "id": 1}},
+    {"name": "chapters by download_status", "collection": "chapters", "filter": {"download_status": "completed"}},
+    {"name": "reading progress by manga", "collection": "reading_progress", "filter": {"user": "default", "manga_id": "x"}},
+    {"name": "chapter summaries batch", "collection": "chapters", "pipeline": chapter_summary_pipeline(["x", "y"])},
+    {"name": "reading progress batch", "collection": "reading_progress",
+     "filter": {"user": "default", "manga_id": {"$in": ["x", "y"]}}},
+    {"name": "source by id", "collection": "sources", "filter": {"id": "x"}},
+    {"name": "sources by type", "collection": "sources", "filter": {"type": "custom"}},
+    {"name": "preferences by user", "collection": "preferences", "filter": {"user": "default"}},
+    {"name": "ready download tasks", "collection": "download_queue", "filter": {"status": "queued", "available_at": {"$lte": datetime.now()}},
+     "sort": {"priority": -1, "available_at": 1}},
+    {"name": "active download task of chapter", "collection": "download_queue", "filter": {"chapter_id": "x", "active": True}},
+    {"name": "expired download leases", "collection": "download_queue", "filter": {"status": "leased", "lease_expires_at": {"$lt": datetime.now()}}},
+    {"name": "chapters changed since", "collection": "chapters", "filter": {"updated_at": {"$gt": datetime.now()}},
+     "sort": {"updated_at": 1, "_id": 1}},
+    {"name": "reading progress changed since", "collection": "reading_progress",
+     "filter": {"user": "default", "updated_at": {"$gt": datetime.now()}}, "sort": {"updated_at": 1, "_id": 1}},
+    {"name": "recent download jobs", "collection": "download_jobs", "filter": {}, "sort": {"created_at": -1}},
+]
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """Create all indexes; safe to run on every startup"""
+    created = {}
     try:
-        # This is a placeholder implementation
-        # In production, you'd implement specific parsers for each source
-        sample_manga = [
-            {
-                "id": f"manga_{uuid.uuid4().hex[:8]}",
-                "title": "One Piece",
-                "title_ar": "قطعة واحدة",
-                "cover_image": "https://via.placeholder.com/300x400",
-                "chapters_count": 1000,
-                "source": source_url
-            },
-            {
-                "id": f"manga_{uuid.uuid4().hex[:8]}",
-                "title": "Naruto",
-                "title_ar": "ناروتو",
-                "cover_image": "https://via.placeholder.com/300x400",
-                "chapters_count": 700,
-                "source": source_url
-            }
-        ]
-        return sample_manga
+        # Progress written before it was keyed per user belongs to the default user
+        await db.reading_progress.update_many({"user": {"$exists": False}}, {"$set": {"user": "default"}})
+        # Tasks queued before the active flag existed
+        await db.download_queue.update_many(
+            {"status": {"$in": ["queued", "leased"]}, "active": {"$exists": False}}, {"$set": {"active": True}}
+        )
+    except ConnectionFailure as e:
+        logger.warning("MongoDB unreachable, skipping index provisioning: %s", e)
+        return created
     except Exception as e:
-        return []
+        logger.warning("Could not migrate reading progress or download tasks: %s", e)
+    for collection, indexes in INDEXES.items():
+        try:
+            created[collection] = await db[collection].create_indexes(indexes)
+        except Exception as e:
+            logger.warning("Could not create indexes on %s: %s", collection, e)
+            created[collection] = []
+    for collection, names in RETIRED_INDEXES.items():
+        try:
+            existing = await db[collection].index_information()
+            for name in set(names) & set(existing):
+                await db[collection].drop_index(name)
+                logger.info("Dropped retired index %s.%s", collection, name)
+        except Exception as e:
+            logger.warning("Could not drop retired indexes on %s: %s", collection, e)
+    return created
+
+def plan_stages(plan: Dict) -> List[str]:
+    """Flatten the stage names of an explain() plan tree"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+async def explain_hot_queries() -> List[Dict[str, Any]]:
+    """Run explain() on every hot query and flag collection scans and in-memory sorts"""
+    report = []
+    for query in HOT_QUERIES:
+        if "pipeline" in query:
+            find = {"aggregate": query["collection"], "pipeline": query["pipeline"], "cursor": {}}
+        else:
+            find = {"find": query["collection"], "filter": query["filter"]}
+            if "sort" in query:
+                find["sort"] = query["sort"]
+        entry = {"name": query["name"], "collection": query["collection"]}
+        try:
+            explained = await db.command({"explain": find, "verbosity": "queryPlanner"})
+            pipeline_stages = explained.get("stages", [])
+            if "queryPlanner" not in explained:
+                # Aggregations that aren't pushed down entirely report the query under $cursor
+                explained = pipeline_stages[0]["$cursor"]
+            stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+            # A sort no index provides is blocking, whether the planner or the pipeline runs it
+            blocking_sort = "SORT" in stages or any("$sort" in stage for stage in pipeline_stages[1:])
+            entry.update(stages=stages, collscan="COLLSCAN" in stages, blocking_sort=blocking_sort)
+        except Exception as e:
+            entry.update(stages=[], collscan=None, blocking_sort=None, error=str(e))
+        report.append(entry)
+    return report
+
+@app.on_event("startup")
+async def provision_indexes():
+    """Make sure every hot query is backed by an index"""
+    await ensure_indexes()
+    await backfill_sync_fields()
+
+@app.on_event("startup")
+async def load_page_cache_index():
+    """Pick up pages cached by a previous run"""
+    await asyncio.get_running_loop().run_in_executor(None, page_cache.load_index)
+    page_cache.evict()
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    """Sample event-loop lag for /api/metrics"""
+    spawn_background(event_loop_lag_monitor())
+
+@app.on_event("startup")
+async def start_progress_flusher():
+    """Write buffered reading progress in the background"""
+    spawn_background(progress_buffer.run())
+
+@app.on_event("startup")
+async def start_source_health_probe():
+    """Keep source health fresh for search"""
+    spawn_background(source_health_loop())
+
+@app.on_event("startup")
+async def start_ledger_reconcile():
+    """Keep the storage ledger in line with the disk"""
+    spawn_background(ledger_reconcile_loop())
+
+@app.on_event("startup")
+async def start_download_worker():
+    """Work the durable download queue in this process"""
+    if DOWNLOAD_WORKER:
+        download_worker.start()
+
+@app.on_event("startup")
+async def start_storage_evictor():
+    """Enforce the downloads storage quota"""
+    if storage_evictor.enabled():
+        spawn_background(storage_evictor.run())
+
+@app.on_event("startup")
+async def start_catalog_index():
+    """Build the local catalog search index"""
+    spawn_background(catalog_index_loop())
 
 # API Routes
 
@@ -168,16 +3530,29 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now()}
 
 @app.get("/api/sources")
-async def get_sources():
+async def get_sources(request: Request, stream: bool = False):
     """Get all manga sources (built-in + custom)"""
-    # Get custom sources from database
-    custom_sources = await db.sources.find({"type": "custom"}).to_list(length=None)
-    
-    # Combine with built-in sources
-    all_sources = BUILT_IN_SOURCES.copy()
-    all_sources.extend(custom_sources)
+    if stream:
+        # NDJSON: built-in sources first, then custom ones straight off the cursor
+        async def lines():
+            for source in BUILT_IN_SOURCES:
+                yield dumps_json(source) + b"\n"
+            async for chunk in iter_ndjson(db.sources.find({"type": "custom"}, {"_id": 0})):
+                yield chunk
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def build():
+        # Get custom sources from database
+        custom_sources = await db.sources.find({"type": "custom"}, {"_id": 0}).to_list(length=None)
+        
+        # Combine with built-in sources
+        all_sources = BUILT_IN_SOURCES.copy()
+        all_sources.extend(custom_sources)
+        
+        return {"sources": all_sources}
     
-    return {"sources": all_sources}
+    return await cached_json_response(request, ["sources"], build)
 
 @app.post("/api/sources")
 async def add_custom_source(source: dict):
@@ -193,15 +3568,16 @@ async def add_custom_source(source: dict):
     )
     
     # Validate URL
-    try:
-        response = requests.head(manga_source.url, timeout=5)
-        if response.status_code >= 400:
-            raise HTTPException(status_code=400, detail="URL is not accessible")
-    except:
+    probe = await probe_source_url(manga_source.url)
+    if probe["http_status"] is not None and probe["status"] != "up":
+        raise HTTPException(status_code=400, detail="URL is not accessible")
+    if probe["status"] != "up":
         raise HTTPException(status_code=400, detail="Invalid or inaccessible URL")
     
     # Save to database
-    await db.sources.insert_one(manga_source.dict())
+    await db.sources.insert_one({**manga_source.dict(), "updated_at": datetime.now(), "version": 1})
+    response_cache.invalidate("sources")
+    spawn_background(check_source_health(manga_source.dict()))
     return {"message": "Source added successfully", "source": manga_source.dict()}
 
 @app.delete("/api/sources/{source_id}")
@@ -210,107 +3586,416 @@ async def delete_source(source_id: str):
     result = await db.sources.delete_one({"id": source_id, "type": "custom"})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Source not found or cannot be deleted")
+    await record_tombstone("sources", source_id)
+    response_cache.invalidate("sources")
+    source_health.pop(source_id, None)
+    await db.source_health.delete_one({"source_id": source_id})
     return {"message": "Source deleted successfully"}
 
+@app.get("/api/sources/health")
+async def get_sources_health():
+    """Latest health probe results for every source"""
+    return {"sources": list(source_health.values())}
+
+@app.post("/api/sources/health/check")
+async def check_sources_health():
+    """Probe all enabled sources now"""
+    return {"sources": await probe_all_sources()}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/diagnostics/query-plans")
+async def get_query_plans():
+    """Explain hot queries and report any collection scans or in-memory sorts"""
+    plans = await explain_hot_queries()
+    return {"queries": plans, "collscans": [p["name"] for p in plans if p["collscan"]],
+            "blocking_sorts": [p["name"] for p in plans if p["blocking_sort"]]}
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Cache sizes and hit/miss/eviction counters"""
+    return {"search": search_cache.stats(), "pages": page_cache.stats(), "translations": translator.stats(),
+            "responses": response_cache.stats(), "progress_buffer": progress_buffer.stats(),
+            "prefetch": prefetcher.stats(), "catalog_index": catalog_index.stats()}
+
+@app.delete("/api/cache/search")
+async def clear_search_cache():
+    """Drop all cached search results"""
+    search_cache.clear()
+    if SEARCH_CACHE_MONGO:
+        await db.search_cache.delete_many({})
+    return {"message": "Search cache cleared"}
+
 @app.get("/api/manga/search")
-async def search_manga(query: str = "", source_id: str = ""):
-    """Search manga across sources"""
-    results = []
-    
+async def search_manga(query: str = "", source_id: str = "", stream: bool = False, scope: str = "remote",
+                       downloaded: bool = False, limit: int = CATALOG_SEARCH_LIMIT, merge: bool = True):
+    """Search manga across sources, or the local catalog with scope=local"""
+    if scope == "local":
+        if not catalog_index.ready:
+            raise HTTPException(status_code=503, detail="Local catalog index is still building")
+        started = time.monotonic()
+        results = catalog_index.search(query, max(1, min(limit, CATALOG_SEARCH_MAX)), downloaded_only=downloaded)
+        return {
+            "results": results,
+            "count": len(results),
+            "sources": [],
+            "partial": False,
+            "scope": "local",
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 2),
+        }
+    if scope != "remote":
+        raise HTTPException(status_code=400, detail="scope must be 'remote' or 'local'")
+
     if source_id:
         # Search in specific source
-        source = await db.sources.find_one({"id": source_id})
-        if source:
-            manga_list = await fetch_manga_from_source(source["url"], query)
-            results.extend(manga_list)
+        source = next((s for s in BUILT_IN_SOURCES if s["id"] == source_id), None)
+        if not source:
+            source = await db.sources.find_one({"id": source_id})
+        sources = [source] if source else []
     else:
         # Search in all sources
-        sources = await db.sources.find({}).to_list(length=None)
-        for source in BUILT_IN_SOURCES + sources:
-            manga_list = await fetch_manga_from_source(source["url"], query)
-            results.extend(manga_list)
-    
-    return {"results": results, "count": len(results)}
+        sources = await all_enabled_sources()
+
+    if stream:
+        # NDJSON: one line per source as it answers, then a summary line.
+        # When merging, "results" carries only series not seen before and
+        # "updated" re-sends known series (matched by series_id) whose primary
+        # or alternatives changed.
+        async def ndjson_lines():
+            merger = SearchMerger()
+            count = 0
+            partial = False
+            async for outcome in iter_source_searches(sources, query, skip_down=not source_id):
+                partial = partial or outcome["partial"]
+                if merge:
+                    outcome["results"], outcome["updated"] = merger.add(outcome)
+                count += len(outcome["results"])
+                yield dumps_json({"type": "source", **outcome}) + b"\n"
+            yield dumps_json({"type": "done", "count": count, "partial": partial}) + b"\n"
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    merger = SearchMerger()
+    results = []
+    source_status = []
+    async for outcome in iter_source_searches(sources, query, skip_down=not source_id):
+        if merge:
+            merger.add(outcome)
+        results.extend(outcome.pop("results"))
+        source_status.append(outcome)
+    if merge:
+        results = merger.results()
+
+    return {
+        "results": results,
+        "count": len(results),
+        "sources": source_status,
+        "partial": any(s["partial"] for s in source_status),
+    }
+
+@app.post("/api/manga/batch")
+async def get_manga_batch(batch: MangaBatchRequest):
+    """Details, chapter summary and reading progress for many manga in one call"""
+    ids = list(dict.fromkeys(batch.ids))
+    if len(ids) > MANGA_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {MANGA_BATCH_MAX} ids per request")
+
+    manga = {m["id"]: m async for m in db.manga.find({"id": {"$in": ids}}, {"_id": 0})}
+    summaries = {row["_id"]: row async for row in db.chapters.aggregate(chapter_summary_pipeline(list(manga)))}
+    progress = {p["manga_id"]: p async for p in db.reading_progress.find(
+        {"user": batch.user, "manga_id": {"$in": list(manga)}}, {"_id": 0}
+    )}
+
+    results = []
+    for manga_id in ids:
+        if manga_id not in manga:
+            continue
+        summary = summaries.get(manga_id, {})
+        results.append({
+            **manga[manga_id],
+            "chapters_count": summary.get("chapters_count", 0),
+            "downloaded_chapters": summary.get("downloaded_chapters", 0),
+            "latest_chapter": summary.get("latest_chapter"),
+            "reading_progress": progress_buffer.get(batch.user, manga_id) or progress.get(manga_id)
+                                or {"manga_id": manga_id, "chapter_id": None, "page": 0},
+        })
+    return FastJSONResponse({"manga": results, "missing": [i for i in ids if i not in manga]})
 
 @app.get("/api/manga/{manga_id}")
-async def get_manga_details(manga_id: str):
+async def get_manga_details(manga_id: str, request: Request):
     """Get detailed manga information"""
-    manga = await db.manga.find_one({"id": manga_id})
-    if not manga:
-        raise HTTPException(status_code=404, detail="Manga not found")
+    async def build():
+        manga = await db.manga.find_one({"id": manga_id}, {"_id": 0})
+        if not manga:
+            raise HTTPException(status_code=404, detail="Manga not found")
+        
+        # Embed only the first chapters; the rest are paged through /chapters
+        window = await find_chapter_page(manga_id, CHAPTER_SUMMARY_WINDOW)
+        manga["chapters"] = window["chapters"]
+        manga["chapters_next_after"] = window["next_after"]
+        manga["chapters_next_after_id"] = window["next_after_id"]
+        manga["chapters_count"] = await db.chapters.count_documents({"manga_id": manga_id})
+        latest = await db.chapters.find({"manga_id": manga_id}, CHAPTER_LIST_PROJECTION).sort(
+            "chapter_number", DESCENDING
+        ).limit(1).to_list(length=1)
+        manga["latest_chapter"] = latest[0] if latest else None
+        
+        return manga
     
-    # Get chapters
-    chapters = await db.chapters.find({"manga_id": manga_id}).sort("chapter_number", ASCENDING).to_list(length=None)
-    manga["chapters"] = chapters
-    
-    return manga
+    return await cached_json_response(request, [f"manga:{manga_id}"], build)
 
 @app.get("/api/manga/{manga_id}/chapters")
-async def get_manga_chapters(manga_id: str):
-    """Get manga chapters"""
-    chapters = await db.chapters.find({"manga_id": manga_id}).sort("chapter_number", ASCENDING).to_list(length=None)
-    return {"chapters": chapters}
+async def get_manga_chapters(manga_id: str, request: Request, limit: int = CHAPTER_PAGE_SIZE,
+                             after: Optional[float] = None, after_id: Optional[str] = None, include_pages: bool = False,
+                             stream: bool = False, compact: bool = False):
+    """Get manga chapters; pass next_after/next_after_id back as after/after_id for the next page
+
+    compact=true keeps page lists in their stored compact form.
+    """
+    if stream:
+        # NDJSON of every chapter after the cursor, without paging
+        query = chapters_after_query(manga_id, after, after_id)
+        cursor = db.chapters.find(query, {"_id": 0} if include_pages else CHAPTER_LIST_PROJECTION)
+        expand = expand_chapter_pages if include_pages and not compact else None
+        return ndjson_response(cursor.sort(CHAPTER_ORDER), transform=expand)
+    if limit < 1 or limit > CHAPTER_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {CHAPTER_PAGE_MAX}")
+    return await cached_json_response(
+        request, [f"manga:{manga_id}"], lambda: find_chapter_page(manga_id, limit, after, after_id, include_pages, compact)
+    )
 
 @app.get("/api/chapter/{chapter_id}")
-async def get_chapter_pages(chapter_id: str):
-    """Get chapter pages for reading"""
-    chapter = await db.chapters.find_one({"id": chapter_id})
-    if not chapter:
-        raise HTTPException(status_code=404, detail="Chapter not found")
+async def get_chapter_pages(chapter_id: str, request: Request, compact: bool = False):
+    """Get chapter pages for reading; compact=true sends the page list as stored (see PageRange/PageSuffixes)"""
+    async def build():
+        chapter = await db.chapters.find_one({"id": chapter_id}, {"_id": 0})
+        if not chapter:
+            raise HTTPException(status_code=404, detail="Chapter not found")
+        
+        return chapter if compact else expand_chapter_pages(chapter)
     
-    return chapter
+    return await cached_json_response(request, [f"chapter:{chapter_id}"], build)
+
+@app.get("/api/chapter/{chapter_id}/pages/{index}")
+async def get_chapter_page_image(chapter_id: str, index: int, request: Request,
+                                 w: Optional[int] = None, fmt: Optional[str] = None):
+    """Serve one page image from the local download or the page cache, optionally resized/re-encoded"""
+    chapter, url = await chapter_page_url(chapter_id, index)
+    width = variant_width(w)
+    if fmt is not None and fmt not in available_variant_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported format; available: {', '.join(available_variant_formats())}")
+    if width and not fmt:
+        fmt = "webp" if "webp" in available_variant_formats() else "jpeg"
+    
+    local = await local_page_source(chapter, index, url)
+    if local:
+        if fmt:
+            # Variants of downloaded pages live next to the chapter
+            variant = os.path.join(local["variants_dir"], variant_name(index, width, fmt))
+            await ensure_variant(local["src"], variant, width, fmt)
+            return serve_file(request, variant, local_file_etag(variant), VARIANT_FORMATS[fmt][1])
+        path, offset, length = local["src"]
+        return serve_file(request, path, local["etag"], local["media_type"], offset=offset, length=length)
+    
+    cached = await page_cache.fetch(url)
+    if fmt:
+        variant = await page_cache.variant(cached, width, fmt)
+        return serve_file(request, variant["path"], variant["etag"], variant["content_type"])
+    return serve_file(request, cached["path"], cached["etag"], cached["content_type"])
 
 @app.post("/api/download/manga/{manga_id}")
-async def download_manga(manga_id: str):
+async def download_manga(manga_id: str, priority: int = DOWNLOAD_PRIORITY_MANGA):
     """Download entire manga"""
-    # This would implement the actual download logic
-    # For now, return a placeholder response
-    return {"message": "Download started", "manga_id": manga_id, "status": "downloading"}
+    manga = await db.manga.find_one({"id": manga_id}, {"_id": 1})
+    if not manga:
+        raise HTTPException(status_code=404, detail="Manga not found")
+
+    # Completed chapters are skipped; partially downloaded ones resume page by page
+    chapters = await db.chapters.find(
+        {"manga_id": manga_id, "download_status": {"$ne": "completed"}}, {"_id": 0, "id": 1, "chapter_number": 1}
+    ).sort("chapter_number", ASCENDING).to_list(length=None)
+
+    await db.manga.update_one({"id": manga_id}, touch({"$set": {"download_status": "downloading"}}))
+    response_cache.invalidate(f"manga:{manga_id}")
+    catalog_index.update_summary(manga_id, download_status="downloading")
+    job = await enqueue_download_job("manga", manga_id, manga_id, chapters, priority)
+
+    return {"message": "Download started", "manga_id": manga_id, "status": "downloading", "job_id": job["id"],
+            "queued_chapters": job["total_chapters"]}
 
 @app.post("/api/download/chapter/{chapter_id}")
-async def download_chapter(chapter_id: str):
+async def download_chapter(chapter_id: str, priority: int = DOWNLOAD_PRIORITY_CHAPTER):
     """Download specific chapter"""
+    chapter = await db.chapters.find_one({"id": chapter_id}, {"_id": 0, "id": 1, "manga_id": 1, "chapter_number": 1})
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+
+    job = await enqueue_download_job("chapter", chapter_id, chapter["manga_id"], [chapter], priority)
+    if not job["total_chapters"]:
+        # Already queued by another job; point the caller at the job doing the work
+        task = await db.download_queue.find_one(
+            {"chapter_id": chapter_id, "active": True}, {"_id": 0, "job_id": 1}
+        )
+        if task:
+            return {"message": "Chapter download already queued", "chapter_id": chapter_id, "job_id": task["job_id"]}
+
+    return {"message": "Chapter download started", "chapter_id": chapter_id, "job_id": job["id"]}
+
+@app.delete("/api/download/chapter/{chapter_id}")
+async def delete_downloaded_chapter(chapter_id: str):
+    """Delete a downloaded chapter from disk"""
     chapter = await db.chapters.find_one({"id": chapter_id})
     if not chapter:
         raise HTTPException(status_code=404, detail="Chapter not found")
     
-    # Placeholder download logic
-    chapter_dir = os.path.join(DOWNLOADS_DIR, chapter["manga_id"], f"chapter_{chapter['chapter_number']}")
-    os.makedirs(chapter_dir, exist_ok=True)
-    
-    # Update download status
-    await db.chapters.update_one(
-        {"id": chapter_id},
-        {"$set": {"download_status": "downloading", "download_path": chapter_dir}}
+    await delete_chapter_files(chapter)
+    await refresh_manga_download_status(chapter["manga_id"])
+    return {"message": "Chapter deleted", "chapter_id": chapter_id}
+
+@app.post("/api/download/chapter/{chapter_id}/pin")
+async def pin_chapter(chapter_id: str):
+    """Keep a downloaded chapter out of quota eviction"""
+    chapter = await db.chapters.find_one_and_update(
+        {"id": chapter_id}, touch({"$set": {"pinned": True}}), projection={"_id": 0, "id": 1, "manga_id": 1}
+    )
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    invalidate_chapter(chapter)
+    return {"message": "Chapter pinned", "chapter_id": chapter_id, "pinned": True}
+
+@app.delete("/api/download/chapter/{chapter_id}/pin")
+async def unpin_chapter(chapter_id: str):
+    """Let the quota evict a chapter again"""
+    chapter = await db.chapters.find_one_and_update(
+        {"id": chapter_id}, touch({"$set": {"pinned": False}}), projection={"_id": 0, "id": 1, "manga_id": 1}
     )
+    if not chapter:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    invalidate_chapter(chapter)
+    storage_evictor.notify()
+    return {"message": "Chapter unpinned", "chapter_id": chapter_id, "pinned": False}
+
+@app.post("/api/download/manga/{manga_id}/pin")
+async def pin_manga(manga_id: str):
+    """Keep every downloaded chapter of a manga out of quota eviction"""
+    result = await db.manga.update_one({"id": manga_id}, touch({"$set": {"pinned": True}}))
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Manga not found")
+    response_cache.invalidate(f"manga:{manga_id}")
+    return {"message": "Manga pinned", "manga_id": manga_id, "pinned": True}
+
+@app.delete("/api/download/manga/{manga_id}/pin")
+async def unpin_manga(manga_id: str):
+    """Let the quota evict a manga's chapters again"""
+    result = await db.manga.update_one({"id": manga_id}, touch({"$set": {"pinned": False}}))
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Manga not found")
+    response_cache.invalidate(f"manga:{manga_id}")
+    storage_evictor.notify()
+    return {"message": "Manga unpinned", "manga_id": manga_id, "pinned": False}
+
+@app.post("/api/downloads/evict")
+async def evict_downloads():
+    """Run the quota evictor now"""
+    if not storage_evictor.enabled():
+        raise HTTPException(status_code=400, detail="No storage quota configured")
+    return await storage_evictor.run_once()
+
+@app.get("/api/download/chapter/{chapter_id}/archive")
+async def download_chapter_archive(chapter_id: str):
+    """Stream a downloaded chapter as a CBZ"""
+    chapter = await db.chapters.find_one({"id": chapter_id}, {"_id": 0})
+    if not chapter or chapter.get("download_status") != "completed":
+        raise HTTPException(status_code=404, detail="Downloaded chapter not found")
+    
+    filename = f"{chapter['manga_id']}_chapter_{chapter['chapter_number']}.cbz"
+    archive = chapter_archive_path(chapter)
+    if os.path.exists(archive):
+        return FileResponse(archive, media_type=CBZ_MEDIA_TYPE, filename=filename)
+    
+    entries = [(os.path.basename(path), path) for _, path in await chapter_archive_entries(chapter)]
+    return await zip_stream_response(entries, CBZ_MEDIA_TYPE, filename)
+
+@app.get("/api/download/manga/{manga_id}/archive")
+async def download_manga_archive(manga_id: str):
+    """Stream every downloaded chapter of a manga as one ZIP"""
+    chapters = await db.chapters.find(
+        {"manga_id": manga_id, "download_status": "completed"}, {"_id": 0}
+    ).sort("chapter_number", ASCENDING).to_list(length=None)
+    if not chapters:
+        raise HTTPException(status_code=404, detail="No downloaded chapters")
     
-    return {"message": "Chapter download started", "chapter_id": chapter_id}
+    entries = []
+    for chapter in chapters:
+        entries.extend(await chapter_archive_entries(chapter))
+    return await zip_stream_response(entries, "application/zip", f"{manga_id}.zip")
+
+@app.get("/api/download/jobs")
+async def get_download_jobs(limit: int = 100):
+    """List recent download jobs with their throughput"""
+    jobs = await db.download_jobs.find({}, {"_id": 0}).sort("created_at", DESCENDING).limit(max(1, min(limit, 1000))).to_list(length=None)
+    return {"jobs": [download_job_summary(job) for job in jobs]}
+
+@app.get("/api/download/jobs/{job_id}")
+async def get_download_job(job_id: str):
+    """Get progress and throughput of a download job"""
+    job = await db.download_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    summary = download_job_summary(job)
+    summary["tasks"] = {row["_id"]: row["count"] async for row in db.download_queue.aggregate([
+        {"$match": {"job_id": job_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ])}
+    return summary
+
+@app.get("/api/download/queue")
+async def get_download_queue():
+    """Queue depth across all workers and this worker's counters"""
+    return await download_queue_stats()
 
 @app.get("/api/downloads/stats")
 async def get_download_stats():
     """Get download statistics"""
     total_manga = await db.manga.count_documents({"download_status": "completed"})
-    total_chapters = await db.chapters.count_documents({"download_status": "completed"})
-    total_size = calculate_directory_size(DOWNLOADS_DIR)
+    stored = await ledger_totals()
+    dedup = await dedup_totals()
+    total_size = max(stored["bytes"] - dedup["bytes_saved"], 0)
     
-    # Get available disk space (simplified)
-    import shutil
     _, _, available_space = shutil.disk_usage(DOWNLOADS_DIR)
     
     return {
         "total_manga": total_manga,
-        "total_chapters": total_chapters,
-        "total_size": total_size,
+        "total_chapters": stored["chapters"],
+        "total_size": total_size,  # on disk, with shared pages counted once
         "total_size_mb": round(total_size / (1024 * 1024), 2),
+        "logical_size": stored["bytes"],  # sum of chapter sizes
         "available_space": available_space,
-        "available_space_gb": round(available_space / (1024 * 1024 * 1024), 2)
+        "available_space_gb": round(available_space / (1024 * 1024 * 1024), 2),
+        "dedup": {
+            "enabled": PAGE_DEDUP and STORAGE_MODE == "directory",
+            **dedup,
+            "bytes_saved_mb": round(dedup["bytes_saved"] / (1024 * 1024), 2),
+        },
+        "quota": {"enabled": storage_evictor.enabled(), **storage_evictor.stats()},
     }
 
+@app.post("/api/downloads/reconcile")
+async def reconcile_downloads():
+    """Rebuild the storage ledger from disk"""
+    return await reconcile_storage_ledger()
+
 @app.get("/api/downloads")
-async def get_downloads():
+async def get_downloads(stream: bool = False):
     """Get all downloaded manga"""
-    downloaded_manga = await db.manga.find({"download_status": {"$in": ["downloading", "completed"]}}).to_list(length=None)
-    return {"downloads": downloaded_manga}
+    cursor = db.manga.find({"download_status": {"$in": ["downloading", "completed"]}}, {"_id": 0})
+    if stream:
+        return ndjson_response(cursor)
+    downloaded_manga = await cursor.to_list(length=None)
+    return FastJSONResponse({"downloads": downloaded_manga})
 
 @app.post("/api/translate")
 async def translate_chapter(chapter_id: str, target_lang: str = "ar"):
@@ -324,63 +4009,108 @@ async def translate_chapter(chapter_id: str, target_lang: str = "ar"):
         translated_title = await translate_text(chapter["title"], target_lang)
         await db.chapters.update_one(
             {"id": chapter_id},
-            {"$set": {"title_ar": translated_title}}
+            touch({"$set": {"title_ar": translated_title}})
         )
+        invalidate_chapter(chapter)
     
     return {"message": "Translation completed", "chapter_id": chapter_id}
 
+@app.post("/api/translate/manga/{manga_id}")
+async def translate_manga(manga_id: str, target_lang: str = "ar"):
+    """Translate every missing title and description of a manga in one background job"""
+    if not re.fullmatch(r"[a-z]{2,3}", target_lang):
+        raise HTTPException(status_code=400, detail="Invalid target language")
+    if not await db.manga.find_one({"id": manga_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Manga not found")
+    
+    job = {
+        "id": uuid.uuid4().hex, "manga_id": manga_id, "target_lang": target_lang, "status": "queued",
+        "manga_fields": 0, "chapters_translated": 0, "started_at": None, "finished_at": None, "error": None,
+    }
+    remember_translation_job(job)
+    spawn_background(run_manga_translation_job(job, manga_id, target_lang))
+    return {"message": "Translation started", "job_id": job["id"]}
+
+@app.get("/api/translate/jobs/{job_id}")
+async def get_translation_job(job_id: str):
+    """Get progress of a manga translation job"""
+    job = translation_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Translation job not found")
+    return job
+
+@app.get("/api/sync")
+async def sync(since: Optional[str] = None, user: str = "default", limit: int = SYNC_PAGE_SIZE):
+    """Documents created, updated or deleted since a sync token"""
+    return FastJSONResponse(await sync_changes(since, user, max(1, min(limit, SYNC_PAGE_MAX))))
+
 @app.get("/api/preferences")
-async def get_user_preferences():
+async def get_user_preferences(request: Request):
     """Get user preferences"""
-    try:
-        prefs = await db.preferences.find_one({"user": "default"})
-        if not prefs:
-            # Return default preferences
+    async def build():
+        try:
+            prefs = await db.preferences.find_one({"user": "default"}, {"_id": 0})
+            if not prefs:
+                # Return default preferences
+                default_prefs = UserPreferences()
+                await db.preferences.insert_one({
+                    "user": "default",
+                    **default_prefs.dict(),
+                    "updated_at": datetime.now(),
+                    "version": 1,
+                })
+                return default_prefs.dict()
+            return prefs
+        except Exception as e:
+            # Return default preferences if database error (not cached)
+            response_cache.invalidate("preferences")
             default_prefs = UserPreferences()
-            await db.preferences.insert_one({
-                "user": "default",
-                **default_prefs.dict()
-            })
             return default_prefs.dict()
-        return prefs
-    except Exception as e:
-        # Return default preferences if database error
-        default_prefs = UserPreferences()
-        return default_prefs.dict()
+    
+    return await cached_json_response(request, ["preferences"], build)
 
 @app.post("/api/preferences")
 async def update_user_preferences(preferences: UserPreferences):
     """Update user preferences"""
     await db.preferences.update_one(
         {"user": "default"},
-        {"$set": preferences.dict()},
+        touch({"$set": preferences.dict()}),
         upsert=True
     )
+    response_cache.invalidate("preferences")
     return {"message": "Preferences updated successfully"}
 
 @app.post("/api/reading-progress")
-async def update_reading_progress(manga_id: str, chapter_id: str, page: int):
+async def update_reading_progress(manga_id: str, chapter_id: str, page: int, user: str = "default"):
     """Update reading progress"""
     progress = {
+        "user": user,
         "manga_id": manga_id,
         "chapter_id": chapter_id,
         "page": page,
         "timestamp": datetime.now()
     }
     
-    await db.reading_progress.update_one(
-        {"manga_id": manga_id},
-        {"$set": progress},
-        upsert=True
-    )
+    # Buffered; written in bulk by the progress flusher
+    progress_buffer.put(progress)
+    spawn_background(observe_reading_progress(user, manga_id, chapter_id, page))
     
     return {"message": "Progress updated"}
 
+@app.delete("/api/reading-progress/{manga_id}/prefetch")
+async def stop_prefetch(manga_id: str, user: str = "default"):
+    """Reader left the manga; cancel prefetches nobody else needs"""
+    prefetcher.leave(user, manga_id)
+    return {"message": "Prefetch stopped"}
+
 @app.get("/api/reading-progress/{manga_id}")
-async def get_reading_progress(manga_id: str):
+async def get_reading_progress(manga_id: str, user: str = "default"):
     """Get reading progress for manga"""
+    buffered = progress_buffer.get(user, manga_id)
+    if buffered:
+        return buffered
     try:
-        progress = await db.reading_progress.find_one({"manga_id": manga_id})
+        progress = await db.reading_progress.find_one({"user": user, "manga_id": manga_id}, {"_id": 0})
         if not progress:
             return {"manga_id": manga_id, "chapter_id": None, "page": 0}
         return progress
@@ -388,6 +4118,77 @@ async def get_reading_progress(manga_id: str):
         # Return default progress if database error
         return {"manga_id": manga_id, "chapter_id": None, "page": 0}
 
+@app.on_event("shutdown")
+async def stop_download_worker():
+    """Hand leased download tasks back to the queue"""
+    await download_worker.stop()
+
+@app.on_event("shutdown")
+async def flush_reading_progress():
+    """Write out buffered reading progress before exiting"""
+    await progress_buffer.flush()
+
+@app.on_event("shutdown")
+async def close_http_session():
+    """Close the pooled HTTP client"""
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+@app.on_event("shutdown")
+async def stop_hash_pool():
+    """Stop the page hashing threads"""
+    if hash_pool is not None:
+        hash_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+async def stop_archive_export_pool():
+    """Stop the ZIP export threads"""
+    if archive_export_pool is not None:
+        archive_export_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+async def stop_transcode_pool():
+    """Stop the image transcoding workers"""
+    if transcode_pool is not None:
+        transcode_pool.shutdown(wait=False, cancel_futures=True)
+
+async def check_query_plans() -> int:
+    """CLI: provision indexes, then fail if any hot query scans a collection or sorts in memory"""
+    await ensure_indexes()
+    plans = await explain_hot_queries()
+    for plan in plans:
+        flag = ("COLLSCAN" if plan["collscan"] else "SORT" if plan["blocking_sort"]
+                else "ERROR" if plan.get("error") else "ok")
+        print(f"{flag:9} {plan['collection']:17} {plan['name']}: {' > '.join(plan['stages']) or plan.get('error')}")
+    return 1 if any(plan["collscan"] or plan["blocking_sort"] or plan.get("error") for plan in plans) else 0
+
+async def run_download_worker():
+    """CLI: work the download queue without serving the API"""
+    await ensure_indexes()
+    download_worker.start()
+    print(f"Download worker {download_worker.id} running with {download_worker.slots} slots")
+    try:
+        await download_worker.task
+    finally:
+        await download_worker.stop()
+        if http_session is not None and not http_session.closed:
+            await http_session.close()
+
 if __name__ == "__main__":
+    if sys.argv[1:] == ["check-indexes"]:
+        sys.exit(asyncio.run(check_query_plans()))
+    if sys.argv[1:] == ["dedup-pages"]:
+        print(json.dumps(asyncio.run(dedup_existing_downloads()), indent=2))
+        sys.exit(0)
+    if sys.argv[1:] == ["compact-pages"]:
+        print(json.dumps(asyncio.run(compact_chapter_pages()), indent=2))
+        sys.exit(0)
+    if sys.argv[1:] == ["download-worker"]:
+        try:
+            asyncio.run(run_download_worker())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
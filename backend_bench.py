@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Load Benchmark for Manga Slayer API
+Seeds a local MongoDB with a realistic library, serves chapter pages from a
+fake manga source, starts the backend and drives concurrent load against
+search, chapter listing, page serving, reading progress and downloads.
+Results are saved as JSON and can be compared against a saved baseline.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import aiohttp
+import requests
+from aiohttp import web
+from pymongo import MongoClient
+
+try:
+    from PIL import Image
+except ImportError:  # pages are then served as opaque bytes and requested untranscoded
+    Image = None
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+SEARCH_TERMS = ["naruto", "one piece", "bleach", "ون بيس", "ناروتو", "hunter", "dragon", "attack"]
+SCENARIOS = ["search", "chapters", "pages", "progress", "downloads"]
+
+
+def make_page_image(image_kb: int) -> bytes:
+    """A decodable JPEG of roughly image_kb, so page variants really get transcoded"""
+    if Image is None:
+        return os.urandom(image_kb * 1024)
+    size, best = (800, 1200), b""
+    for grain in range(1, 33):
+        # Coarser noise compresses better; pick the grain that lands closest to the target
+        noise = Image.frombytes("RGB", (size[0] // grain, size[1] // grain), os.urandom(size[0] // grain * (size[1] // grain) * 3))
+        buffer = io.BytesIO()
+        noise.resize(size).save(buffer, "JPEG", quality=85)
+        data = buffer.getvalue()
+        if not best or abs(len(data) - image_kb * 1024) < abs(len(best) - image_kb * 1024):
+            best = data
+        if len(data) < image_kb * 1024:
+            break
+    return best
+
+
+class FakeMangaSource:
+    """Stand-in manga source serving generated page images with configurable latency"""
+
+    def __init__(self, port: int, latency_ms: float, jitter_ms: float, image_kb: int):
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.image = make_page_image(image_kb)
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def index(self, request):
+        return web.Response(text="ok")
+
+    async def page(self, request):
+        self.requests += 1
+        await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+        return web.Response(body=self.image, content_type="image/jpeg")
+
+    def start(self):
+        async def setup():
+            app = web.Application()
+            app.router.add_get("/", self.index)
+            app.router.add_get("/img/{manga}/{chapter}/{page}", self.page)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", self.port).start()
+
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(setup(), self.loop).result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class MangaSlayerBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = f"http://127.0.0.1:{args.port}"
+        self.workdir = tempfile.mkdtemp(prefix="manga_bench_")
+        self.source = FakeMangaSource(args.source_port, args.source_latency_ms, args.source_jitter_ms, args.image_kb)
+        self.mongod: Optional[subprocess.Popen] = None
+        self.backend: Optional[subprocess.Popen] = None
+        self.rss_samples: List[int] = []
+        self.manga_ids: List[str] = []
+
+    # Environment
+
+    def start_mongo(self):
+        """Start a throwaway mongod when requested"""
+        if not self.args.start_mongo:
+            return
+        mongod = shutil.which("mongod")
+        if not mongod:
+            sys.exit("mongod not found on PATH; run MongoDB yourself and pass --mongo-url")
+        dbpath = os.path.join(self.workdir, "db")
+        os.makedirs(dbpath)
+        port = self.args.mongo_port
+        self.mongod = subprocess.Popen(
+            [mongod, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.args.mongo_url = f"mongodb://127.0.0.1:{port}"
+        print(f"🗄️  Started mongod on port {port}")
+
+    def seed(self):
+        """Insert the benchmark library in bulk"""
+        mongo = MongoClient(self.args.mongo_url, serverSelectionTimeoutMS=10000)
+        db = mongo[self.args.db]
+        self.manga_ids = [f"bench_manga_{i}" for i in range(self.args.manga)]
+        if self.args.skip_seed:
+            print("🌱 Reusing existing benchmark data")
+            return
+
+        print(f"🌱 Seeding {self.args.manga} manga x {self.args.chapters} chapters x {self.args.pages} pages...")
+        started = time.time()
+        mongo.drop_database(self.args.db)
+        db.sources.insert_one({
+            "id": "bench_source", "name": "Bench Source", "url": self.source.base_url,
+            "type": "custom", "enabled": True, "added_date": datetime.now()
+        })
+        db.manga.insert_many([{
+            "id": manga_id,
+            "title": f"Bench Manga {i} {random.choice(SEARCH_TERMS)}",
+            "title_ar": f"مانجا تجريبية {i}",
+            "description": "Benchmark series",
+            "description_ar": "",
+            "cover_image": f"{self.source.base_url}/img/{manga_id}/cover/0.jpg",
+            "source": "bench_source",
+            "total_size": 0,
+            "download_status": "not_downloaded",
+        } for i, manga_id in enumerate(self.manga_ids)])
+
+        batch = []
+        chapters = 0
+        for manga_id in self.manga_ids:
+            for number in range(1, self.args.chapters + 1):
+                chapters += 1
+                batch.append({
+                    "id": f"{manga_id}_c{number}",
+                    "manga_id": manga_id,
+                    "chapter_number": float(number),
+                    "title": f"Chapter {number}",
+                    "title_ar": "",
+                    "pages": [f"{self.source.base_url}/img/{manga_id}/{number}/{p:03d}.jpg" for p in range(self.args.pages)],
+                    "size": 0,
+                    "download_status": "not_downloaded",
+                    "download_path": "",
+                })
+                if len(batch) >= 10000:
+                    db.chapters.insert_many(batch, ordered=False)
+                    batch = []
+        if batch:
+            db.chapters.insert_many(batch, ordered=False)
+        print(f"   Seeded {chapters} chapters in {time.time() - started:.1f}s")
+
+    def start_backend(self):
+        env = dict(os.environ)
+        env.update({
+            "MONGO_URL": self.args.mongo_url,
+            "MONGO_DB": self.args.db,
+            "DOWNLOADS_DIR": os.path.join(self.workdir, "downloads"),
+            "PAGE_CACHE_DIR": os.path.join(self.workdir, "page_cache"),
+        })
+        self.backend = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+             "--port", str(self.args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.base_url}/api/health", timeout=1).status_code == 200:
+                    print(f"🚀 Backend up on {self.base_url}")
+                    return
+            except Exception:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        sys.exit("Backend did not become healthy within 60s")
+
+    def sample_memory(self, stop: threading.Event):
+        """Record backend resident memory (Linux /proc) while the load runs"""
+        while not stop.is_set():
+            try:
+                with open(f"/proc/{self.backend.pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            self.rss_samples.append(int(line.split()[1]))
+            except OSError:
+                pass
+            stop.wait(0.5)
+
+    def stop(self):
+        for process in (self.backend, self.mongod):
+            if process and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        self.source.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    # Load
+
+    def request_for(self, scenario: str, rng: random.Random) -> tuple:
+        """(method, path) of one request of a scenario"""
+        manga_id = rng.choice(self.manga_ids)
+        chapter_id = f"{manga_id}_c{rng.randint(1, self.args.chapters)}"
+        if scenario == "search":
+            return "GET", f"/api/manga/search?query={rng.choice(SEARCH_TERMS)}"
+        if scenario == "chapters":
+            after = rng.randint(0, max(self.args.chapters - 100, 0))
+            return "GET", f"/api/manga/{manga_id}/chapters?limit=100&after={after}"
+        if scenario == "pages":
+            path = f"/api/chapter/{chapter_id}/pages/{rng.randrange(self.args.pages)}"
+            return "GET", f"{path}?w={self.args.page_width}" if self.args.page_width else path
+        if scenario == "progress":
+            return "POST", f"/api/reading-progress?manga_id={manga_id}&chapter_id={chapter_id}&page={rng.randrange(self.args.pages)}"
+        return "POST", f"/api/download/chapter/{chapter_id}"
+
+    async def run_scenario(self, scenario: str) -> Dict[str, Any]:
+        latencies: List[float] = []
+        errors = 0
+        deadline = time.monotonic() + self.args.duration
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        timeout = aiohttp.ClientTimeout(total=30)
+
+        async with aiohttp.ClientSession(self.base_url, connector=connector, timeout=timeout) as session:
+            async def worker(seed: int):
+                nonlocal errors
+                rng = random.Random(seed)
+                while time.monotonic() < deadline:
+                    method, path = self.request_for(scenario, rng)
+                    started = time.monotonic()
+                    try:
+                        async with session.request(method, path) as response:
+                            await response.read()
+                            if response.status >= 400:
+                                errors += 1
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        errors += 1
+                    latencies.append(time.monotonic() - started)
+
+            started = time.monotonic()
+            await asyncio.gather(*[worker(self.args.seed + i) for i in range(self.args.concurrency)])
+            elapsed = time.monotonic() - started
+
+        latencies.sort()
+
+        def percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 2)
+
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        }
+
+    async def download_throughput(self) -> Dict[str, Any]:
+        """Combined throughput of the download jobs started by the downloads scenario"""
+        async with aiohttp.ClientSession(self.base_url) as session:
+            async with session.get("/api/download/jobs") as response:
+                jobs = (await response.json()).get("jobs", [])
+        return {
+            "jobs": len(jobs),
+            "pages": sum(job["pages_downloaded"] for job in jobs),
+            "pages_per_second": round(sum(job["pages_per_second"] for job in jobs), 2),
+            "mb_per_second": round(sum(job["mb_per_second"] for job in jobs), 3),
+        }
+
+    def run(self) -> Dict[str, Any]:
+        print("🚀 Starting Manga Slayer Load Benchmark...")
+        print("=" * 60)
+        self.source.start()
+        self.start_mongo()
+        try:
+            self.seed()
+            self.start_backend()
+            stop = threading.Event()
+            sampler = threading.Thread(target=self.sample_memory, args=(stop,), daemon=True)
+            sampler.start()
+
+            scenarios = {}
+            for scenario in self.args.scenarios:
+                print(f"\n🔍 {scenario}: {self.args.concurrency} workers for {self.args.duration}s")
+                scenarios[scenario] = asyncio.run(self.run_scenario(scenario))
+                result = scenarios[scenario]
+                print(f"   {result['rps']} req/s  p50 {result['p50_ms']}ms  p95 {result['p95_ms']}ms  "
+                      f"p99 {result['p99_ms']}ms  errors {result['errors']}")
+                if scenario == "downloads":
+                    result["throughput"] = asyncio.run(self.download_throughput())
+                    print(f"   downloads: {result['throughput']['pages_per_second']} pages/s, "
+                          f"{result['throughput']['mb_per_second']} MB/s")
+
+            stop.set()
+            sampler.join()
+        finally:
+            self.stop()
+
+        return {
+            "created_at": datetime.now().isoformat(),
+            "config": {
+                "manga": self.args.manga, "chapters": self.args.chapters, "pages": self.args.pages,
+                "image_kb": self.args.image_kb, "page_width": self.args.page_width,
+                "source_latency_ms": self.args.source_latency_ms,
+                "concurrency": self.args.concurrency, "duration": self.args.duration,
+            },
+            "scenarios": scenarios,
+            "memory": {
+                "rss_peak_mb": round(max(self.rss_samples, default=0) / 1024, 1),
+                "rss_end_mb": round((self.rss_samples[-1] if self.rss_samples else 0) / 1024, 1),
+            },
+            "source_requests": self.source.requests,
+        }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of results against a baseline beyond the given tolerance"""
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        current = results["scenarios"].get(name)
+        if not current:
+            continue
+        if base["rps"] and current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if base[key] and current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {base[key]} -> {current[key]}")
+    base_rss = baseline.get("memory", {}).get("rss_peak_mb", 0)
+    if base_rss and results["memory"]["rss_peak_mb"] > base_rss * (1 + tolerance):
+        regressions.append(f"memory: rss_peak_mb {base_rss} -> {results['memory']['rss_peak_mb']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manga Slayer load benchmark")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="manga_slayer_bench")
+    parser.add_argument("--start-mongo", action="store_true", help="run a throwaway mongod")
+    parser.add_argument("--mongo-port", type=int, default=27117)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data from a previous run")
+    parser.add_argument("--manga", type=int, default=2000)
+    parser.add_argument("--chapters", type=int, default=100, help="chapters per manga")
+    parser.add_argument("--pages", type=int, default=20, help="pages per chapter")
+    parser.add_argument("--image-kb", type=int, default=300)
+    parser.add_argument("--page-width", type=int, default=720, help="resize served pages to this width; 0 serves originals")
+    parser.add_argument("--source-port", type=int, default=8012)
+    parser.add_argument("--source-latency-ms", type=float, default=50)
+    parser.add_argument("--source-jitter-ms", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression ratio")
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.page_width and Image is None:
+        print("⚠️  Pillow is not installed; page images can't be transcoded, serving originals instead")
+        args.page_width = 0
+    random.seed(args.seed)
+
+    results = MangaSlayerBenchmark(args).run()
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print("\n" + "=" * 60)
+    print(f"📊 Results saved to {args.output}")
+    print(f"   Peak RSS: {results['memory']['rss_peak_mb']} MB")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"   Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
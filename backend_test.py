@@ -7,6 +7,7 @@ Tests all API endpoints defined in the FastAPI backend
 import requests
 import sys
 import json
+import time
 from datetime import datetime
 from typing import Dict, Any
 
@@ -90,6 +91,12 @@ class MangaSlayerAPITester:
         sources = sources_response.get("sources", [])
         print(f"   Found {len(sources)} sources")
         
+        # Test source health
+        success, health_response = self.run_test("Get Sources Health", "GET", "/sources/health")
+        if success:
+            down = [h for h in health_response.get("sources", []) if h.get("status") != "up"]
+            print(f"   {len(down)} sources currently down")
+        
         # Test add custom source
         test_source = {
             "name": "Test Manga Source",
@@ -135,6 +142,80 @@ class MangaSlayerAPITester:
         if success:
             results = response.get("results", [])
             print(f"   Found {len(results)} manga for 'naruto'")
+            print(f"   Partial results: {response.get('partial', False)}")
+            print(f"   Alternative sources: {sum(len(r.get('alternatives', [])) for r in results)}")
+        
+        # Test raw per-source results without cross-source merging
+        success, response = self.run_test("Search Manga (Unmerged)", "GET", "/manga/search?query=naruto&merge=false")
+        if success:
+            print(f"   Found {response.get('count', 0)} unmerged results")
+        
+        # Test streamed search (NDJSON, one line per source)
+        success, response = self.run_test("Search Manga (Streamed)", "GET", "/manga/search?query=naruto&stream=true")
+        if success:
+            lines = response.get("raw_response", "").strip().splitlines()
+            print(f"   Received {len(lines)} NDJSON lines")
+        
+        # Test offline search over the local catalog
+        success, response = self.run_test("Search Manga (Local)", "GET", "/manga/search?query=ناروتو&scope=local")
+        if success:
+            print(f"   Found {response.get('count', 0)} local manga in {response.get('elapsed_ms')}ms")
+        
+        # A one-letter typo finds the same manga as the exact term
+        _, exact = self.run_test("Search Manga (Local, Exact)", "GET", "/manga/search?query=naruto&scope=local")
+        _, typo = self.run_test("Search Manga (Local, Misspelled)", "GET", "/manga/search?query=narto&scope=local")
+        exact_ids = {m.get("id") for m in exact.get("results", [])}
+        typo_ids = {m.get("id") for m in typo.get("results", [])}
+        self.log_test("Search Manga (Typo Matches Exact)", exact_ids <= typo_ids,
+                      f"{len(exact_ids)} exact, {len(typo_ids)} misspelled")
+
+        self.run_test("Search Manga (Bad Scope)", "GET", "/manga/search?query=naruto&scope=galaxy", 400)
+        
+        return success
+
+    def test_metrics(self):
+        """Test Prometheus metrics endpoint"""
+        success, response = self.run_test("Get Metrics", "GET", "/metrics")
+        if success:
+            text = response.get("raw_response", "")
+            print(f"   {len([l for l in text.splitlines() if l and not l.startswith('#')])} samples exported")
+        
+        return success
+
+    def test_query_plans(self):
+        """Test query plan diagnostics"""
+        success, response = self.run_test("Get Query Plans", "GET", "/diagnostics/query-plans")
+        if success:
+            collscans = response.get("collscans", [])
+            print(f"   Collection scans: {', '.join(collscans) if collscans else 'none'}")
+            blocking_sorts = response.get("blocking_sorts", [])
+            print(f"   In-memory sorts: {', '.join(blocking_sorts) if blocking_sorts else 'none'}")
+        
+        return success
+
+    def test_conditional_get(self):
+        """Test ETag revalidation on read-mostly endpoints"""
+        url = f"{self.base_url}/api/sources"
+        try:
+            first = requests.get(url, timeout=10)
+            etag = first.headers.get("ETag")
+            if not etag:
+                self.log_test("Conditional GET (304 Expected)", False, "No ETag header")
+                return False
+            second = requests.get(url, headers={"If-None-Match": etag}, timeout=10)
+            success = second.status_code == 304
+            self.log_test("Conditional GET (304 Expected)", success, f"Status: {second.status_code}")
+            return success
+        except requests.exceptions.RequestException as e:
+            self.log_test("Conditional GET (304 Expected)", False, f"Request failed: {str(e)}")
+            return False
+
+    def test_cache_stats(self):
+        """Test cache statistics"""
+        success, response = self.run_test("Get Cache Stats", "GET", "/cache/stats")
+        if success:
+            search = response.get("search", {})
+            print(f"   Search cache: {search.get('size', 0)} entries, hit ratio {search.get('hit_ratio', 0)}")
         
         return success
 
@@ -149,6 +230,7 @@ class MangaSlayerAPITester:
             print(f"   Total chapters: {stats.get('total_chapters', 0)}")
             print(f"   Total size: {stats.get('total_size_mb', 0)} MB")
             print(f"   Available space: {stats.get('available_space_gb', 0)} GB")
+            print(f"   Saved by page dedup: {stats.get('dedup', {}).get('bytes_saved_mb', 0)} MB")
         
         return success
 
@@ -159,6 +241,12 @@ class MangaSlayerAPITester:
             downloads = response.get("downloads", [])
             print(f"   Found {len(downloads)} downloaded manga")
         
+        # Test NDJSON variant streamed from the cursor
+        success, response = self.run_test("Get Downloads List (Streamed)", "GET", "/downloads?stream=true")
+        if success:
+            lines = response.get("raw_response", "").strip().splitlines()
+            print(f"   Received {len(lines)} NDJSON lines")
+        
         return success
 
     def test_preferences(self):
@@ -204,6 +292,17 @@ class MangaSlayerAPITester:
         test_manga_id = "test_manga_123"
         test_chapter_id = "test_chapter_123"
         
+        # Test batch lookup (unknown ids are reported as missing)
+        success, response = self.run_test(
+            "Batch Manga Lookup",
+            "POST",
+            "/manga/batch",
+            200,
+            {"ids": [test_manga_id]}
+        )
+        if success:
+            print(f"   Found {len(response.get('manga', []))}, missing {len(response.get('missing', []))}")
+        
         # Test get manga details (expect 404)
         success, _ = self.run_test(
             "Get Manga Details (404 Expected)",
@@ -212,6 +311,23 @@ class MangaSlayerAPITester:
             404
         )
         
+        # Test paged chapter listing
+        success, response = self.run_test(
+            "Get Manga Chapters (Paged)",
+            "GET",
+            f"/manga/{test_manga_id}/chapters?limit=50"
+        )
+        if success:
+            print(f"   Chapters: {len(response.get('chapters', []))}, more: {response.get('has_more')}")
+        
+        # Test chapter listing with an invalid page size (expect 400)
+        success, _ = self.run_test(
+            "Get Manga Chapters (400 Expected)",
+            "GET",
+            f"/manga/{test_manga_id}/chapters?limit=0",
+            400
+        )
+        
         # Test get chapter pages (expect 404)
         success, _ = self.run_test(
             "Get Chapter Pages (404 Expected)",
@@ -219,12 +335,37 @@ class MangaSlayerAPITester:
             f"/chapter/{test_chapter_id}",
             404
         )
+
+        # Test compact page list (expect 404)
+        success, _ = self.run_test(
+            "Get Compact Chapter Pages (404 Expected)",
+            "GET",
+            f"/chapter/{test_chapter_id}?compact=true",
+            404
+        )
+
+        # Test page image proxy (expect 404)
+        success, _ = self.run_test(
+            "Get Chapter Page Image (404 Expected)",
+            "GET",
+            f"/chapter/{test_chapter_id}/pages/0",
+            404
+        )
         
-        # Test download manga
+        # Test resized page variant (expect 404)
         success, _ = self.run_test(
-            "Download Manga",
+            "Get Chapter Page Variant (404 Expected)",
+            "GET",
+            f"/chapter/{test_chapter_id}/pages/0?w=720&fmt=webp",
+            404
+        )
+        
+        # Test download manga (expect 404)
+        success, _ = self.run_test(
+            "Download Manga (404 Expected)",
             "POST",
-            f"/download/manga/{test_manga_id}"
+            f"/download/manga/{test_manga_id}",
+            404
         )
         
         # Test download chapter (expect 404)
@@ -235,8 +376,59 @@ class MangaSlayerAPITester:
             404
         )
         
+        # Test chapter archive export (expect 404)
+        success, _ = self.run_test(
+            "Get Chapter Archive (404 Expected)",
+            "GET",
+            f"/download/chapter/{test_chapter_id}/archive",
+            404
+        )
+        
+        # Test manga archive export (expect 404)
+        success, _ = self.run_test(
+            "Get Manga Archive (404 Expected)",
+            "GET",
+            f"/download/manga/{test_manga_id}/archive",
+            404
+        )
+        
+        # Test delete downloaded chapter (expect 404)
+        success, _ = self.run_test(
+            "Delete Downloaded Chapter (404 Expected)",
+            "DELETE",
+            f"/download/chapter/{test_chapter_id}",
+            404
+        )
+        
+        # Test pinning unknown chapter/manga (expect 404)
+        self.run_test("Pin Chapter (404 Expected)", "POST", f"/download/chapter/{test_chapter_id}/pin", 404)
+        self.run_test("Pin Manga (404 Expected)", "POST", f"/download/manga/{test_manga_id}/pin", 404)
+        
         return True  # These are expected to have mixed results
 
+    def test_download_jobs(self):
+        """Test download job reporting"""
+        print("\n🔍 Testing Download Jobs...")
+        
+        success, response = self.run_test("Get Download Jobs", "GET", "/download/jobs")
+        if success:
+            print(f"   Found {len(response.get('jobs', []))} download jobs")
+        
+        # Test unknown job (expect 404)
+        self.run_test(
+            "Get Download Job (404 Expected)",
+            "GET",
+            "/download/jobs/unknown_job",
+            404
+        )
+        
+        # Test durable queue depth
+        success, response = self.run_test("Get Download Queue", "GET", "/download/queue")
+        if success:
+            print(f"   Queue tasks: {response.get('tasks', {})}")
+        
+        return success
+
     def test_translation_endpoint(self):
         """Test translation functionality"""
         print("\n🔍 Testing Translation...")
@@ -251,6 +443,14 @@ class MangaSlayerAPITester:
             404
         )
         
+        # Test bulk manga translation (expect 404)
+        success, _ = self.run_test(
+            "Translate Manga (404 Expected)",
+            "POST",
+            "/translate/manga/test_manga_123?target_lang=ar",
+            404
+        )
+        
         return True  # Expected to fail due to no data
 
     def test_reading_progress(self):
@@ -279,6 +479,127 @@ class MangaSlayerAPITester:
         
         return success
 
+    def test_progress_buffer(self):
+        """Test buffered reading progress writes"""
+        print("\n🔍 Testing Progress Buffer...")
+        
+        user = f"buffer_test_{int(time.time())}"
+        test_manga_id = "test_manga_buffer"
+        
+        # A read straight after the write is served from the buffer
+        self.run_test(
+            "Buffer Reading Progress",
+            "POST",
+            f"/reading-progress?manga_id={test_manga_id}&chapter_id=test_chapter_buffer&page=7&user={user}"
+        )
+        success, response = self.run_test("Read Buffered Progress", "GET", f"/reading-progress/{test_manga_id}?user={user}")
+        self.log_test("Progress Read-After-Write", success and response.get("page") == 7,
+                      f"Page: {response.get('page')}")
+        
+        _, stats = self.run_test("Get Progress Buffer Stats", "GET", "/cache/stats")
+        buffer_stats = stats.get("progress_buffer", {})
+        counters = ("updates", "flushes", "flushed_entries", "pending", "interval", "max_flush_lag_ms")
+        missing = [name for name in counters if name not in buffer_stats]
+        self.log_test("Progress Buffer Counters", not missing, f"Missing: {missing}" if missing else "")
+        
+        # After a flush interval the buffer is empty, so the read comes from MongoDB
+        time.sleep(buffer_stats.get("interval", 0.5) * 2 + 0.5)
+        _, stats = self.run_test("Get Progress Buffer Stats (After Flush)", "GET", "/cache/stats")
+        after = stats.get("progress_buffer", {})
+        print(f"   Flushes: {after.get('flushes', 0)}, pending: {after.get('pending', 0)}, "
+              f"max lag: {after.get('max_flush_lag_ms', 0)}ms")
+        flushed = after.get("flushed_entries", 0) > buffer_stats.get("flushed_entries", 0) or after.get("pending") == 0
+        _, response = self.run_test("Read Flushed Progress", "GET", f"/reading-progress/{test_manga_id}?user={user}")
+        success = flushed and response.get("page") == 7
+        self.log_test("Progress Flushed To MongoDB", success,
+                      f"Flushed entries: {after.get('flushed_entries')}, page: {response.get('page')}")
+        
+        return success
+
+    def find_prefetch_candidate(self):
+        """A chapter with pages whose next chapter is not downloaded, or None"""
+        # A full delta sync lists every chapter without its pages
+        by_manga: Dict[str, list] = {}
+        token = None
+        for _ in range(20):
+            endpoint = "/sync?limit=1000" + (f"&since={token}" if token else "")
+            response = requests.get(f"{self.base_url}/api{endpoint}", timeout=30).json()
+            for chapter in response.get("changes", {}).get("chapters", []):
+                by_manga.setdefault(chapter.get("manga_id"), []).append(chapter)
+            token = response.get("token")
+            if not response.get("has_more"):
+                break
+        for manga_id, chapters in by_manga.items():
+            chapters.sort(key=lambda c: c.get("chapter_number", 0))
+            for current, upcoming in zip(chapters, chapters[1:]):
+                if upcoming.get("download_status") == "completed":
+                    continue
+                response = requests.get(f"{self.base_url}/api/chapter/{current['id']}", timeout=10)
+                pages = response.json().get("pages", []) if response.status_code == 200 else []
+                if pages:
+                    return manga_id, current["id"], len(pages)
+        return None
+
+    def test_chapter_prefetch(self):
+        """Test next-chapter prefetching"""
+        print("\n🔍 Testing Chapter Prefetch...")
+        
+        user = f"prefetch_test_{int(time.time())}"
+        success, stats = self.run_test("Get Prefetch Stats", "GET", "/cache/stats")
+        before = stats.get("prefetch", {})
+        counters = ("scheduled", "deduplicated", "completed", "cancelled", "pages_warmed", "active", "readers")
+        missing = [name for name in counters if name not in before]
+        self.log_test("Prefetch Counters", success and not missing, f"Missing: {missing}" if missing else "")
+        
+        try:
+            candidate = self.find_prefetch_candidate()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            candidate = None
+            print(f"   Could not look for chapters: {str(e)}")
+        if candidate is None:
+            print("   No chapter with a pending next chapter; skipping prefetch trigger")
+            self.run_test("Stop Prefetch", "DELETE", f"/reading-progress/test_manga_123/prefetch?user={user}")
+            return success
+        
+        # A position inside the last PREFETCH_TRIGGER_PAGES pages warms the next chapter
+        manga_id, chapter_id, page_count = candidate
+        self.run_test(
+            "Read Near Chapter End",
+            "POST",
+            f"/reading-progress?manga_id={manga_id}&chapter_id={chapter_id}&page={page_count - 1}&user={user}"
+        )
+        time.sleep(0.5)
+        _, stats = self.run_test("Get Prefetch Stats (Triggered)", "GET", "/cache/stats")
+        triggered = stats.get("prefetch", {})
+        started = (triggered.get("scheduled", 0) + triggered.get("deduplicated", 0)
+                   > before.get("scheduled", 0) + before.get("deduplicated", 0))
+        self.log_test("Prefetch Next Chapter", started, f"Before: {before}, after: {triggered}")
+        
+        # Leaving the manga cancels a prefetch nobody else is waiting for
+        self.run_test("Stop Prefetch", "DELETE", f"/reading-progress/{manga_id}/prefetch?user={user}")
+        _, stats = self.run_test("Get Prefetch Stats (Stopped)", "GET", "/cache/stats")
+        stopped = stats.get("prefetch", {})
+        finished = (stopped.get("cancelled", 0) + stopped.get("completed", 0)
+                    > triggered.get("cancelled", 0) + triggered.get("completed", 0))
+        self.log_test("Prefetch Cancelled On Leave", finished or not triggered.get("active"),
+                      f"Before: {triggered}, after: {stopped}")
+        
+        return started
+
+    def test_delta_sync(self):
+        """Test delta sync paging"""
+        print("\n🔍 Testing Delta Sync...")
+        
+        success, response = self.run_test("Full Sync", "GET", "/sync?limit=50")
+        if success:
+            print(f"   Token: {response.get('token')}, more: {response.get('has_more')}")
+            if response.get('token'):
+                self.run_test("Incremental Sync", "GET", f"/sync?since={response['token']}")
+        
+        self.run_test("Sync With Bad Token", "GET", "/sync?since=not-a-token", 400)
+        
+        return success
+
     def run_all_tests(self):
         """Run all API tests"""
         print("🚀 Starting Manga Slayer API Tests...")
@@ -287,16 +608,24 @@ class MangaSlayerAPITester:
         
         # Core functionality tests
         self.test_health_check()
+        self.test_query_plans()
+        self.test_metrics()
         self.test_sources_management()
         self.test_manga_search()
+        self.test_conditional_get()
+        self.test_cache_stats()
         self.test_download_stats()
         self.test_downloads_list()
         self.test_preferences()
         
         # Data-dependent tests (may fail due to no seeded data)
         self.test_manga_detail_endpoints()
+        self.test_download_jobs()
         self.test_translation_endpoint()
         self.test_reading_progress()
+        self.test_progress_buffer()
+        self.test_chapter_prefetch()
+        self.test_delta_sync()
         
         # Print summary
         print("\n" + "=" * 60)